@@ -0,0 +1,22 @@
+from seqpy import Sequence, Gaussian, Drag, Carrier, sweepables
+
+SAMP_FREQ = 2.4e9
+
+
+def gate_sequence(n_pulses, n_channels, sweepable=False):
+    # a gate train built from a small gate set, n_pulses in total spread over the channels
+    amp, delay = sweepables("amp delay") if sweepable else (0.5, 0)
+    x_pi = Gaussian(20e-9) * amp
+    x_pi_2 = Gaussian(20e-9) * 0.25
+    y_drag = Drag(20e-9) * 0.1
+    carriers = [Carrier(100e6 + 10e6 * ch, 0) for ch in range(n_channels)]
+    sequence = Sequence(n_channels)
+    for i in range(n_pulses):
+        ch = i % n_channels
+        pulse = (x_pi, x_pi_2, y_drag)[(i // n_channels) % 3]
+        position = (i // n_channels) * 30e-9 + delay
+        sequence.register(position, pulse, carriers[ch], channel=ch)
+    if sweepable:
+        sequence.subs(amp, 0.5)
+        sequence.subs(delay, 0)
+    return sequence
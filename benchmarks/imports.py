@@ -0,0 +1,46 @@
+import subprocess
+import sys
+
+# imported by seqpy only when they are used: plotting, IQShifter and the devices
+heavy_modules = ["matplotlib", "scipy", "zhinst"]
+# in second, for importing everything exported by seqpy
+import_budget = 1.0
+import_all = "import seqpy\nfor name in seqpy.__all__:\n    getattr(seqpy, name)"
+
+
+def run_import(statement):
+    # time statement in a fresh interpreter, returns the time and the heavy modules imported
+    code = (
+        "import sys, time\n"
+        "start = time.perf_counter()\n"
+        f"{statement}\n"
+        "elapsed = time.perf_counter() - start\n"
+        f"print(elapsed, *[m for m in {heavy_modules!r} if m in sys.modules])\n"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", code], check=True, capture_output=True, text=True
+    ).stdout.split()
+    return float(output[0]), output[1:]
+
+
+class Import:
+    timeout = 120
+
+    def timeraw_import_seqpy(self):
+        return "import seqpy"
+
+    def timeraw_import_all(self):
+        return import_all
+
+    def track_import_all(self):
+        # fails if a heavy module is imported eagerly or the budget is exceeded
+        elapsed, imported = run_import(import_all)
+        if imported:
+            raise Exception(f"{', '.join(imported)} imported by seqpy.")
+        if elapsed > import_budget:
+            raise Exception(
+                f"importing seqpy took {elapsed:.3f} s, more than {import_budget} s."
+            )
+        return elapsed
+
+    track_import_all.unit = "seconds"
@@ -0,0 +1,137 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+import tempfile
+import numpy as np
+import seqpy.static as static
+from seqpy import envelope_cache
+from .common import gate_sequence, SAMP_FREQ
+
+
+class Waveforms:
+    params = ([10, 100, 1000, 10000], [1, 8], [False, True])
+    param_names = ["n_pulses", "n_channels", "sweepable"]
+    timeout = 300
+
+    def setup(self, n_pulses, n_channels, sweepable):
+        self.sequence = gate_sequence(n_pulses, n_channels, sweepable)
+        self.sequence.waveforms(SAMP_FREQ)
+
+    def _render(self):
+        envelope_cache.clear()
+        self.sequence._changed = True
+        self.sequence.waveforms(SAMP_FREQ)
+
+    def time_waveforms(self, *params):
+        self._render()
+
+    def peakmem_waveforms(self, *params):
+        self._render()
+
+
+class CompactWaveforms:
+    # rendered to the dtypes of the devices
+    params = ([1000, 10000], ["float64", "float32", "int16"])
+    param_names = ["n_pulses", "dtype"]
+    timeout = 300
+
+    def setup(self, n_pulses, dtype):
+        self.sequence = gate_sequence(n_pulses, 8, True)
+        self.sequence.waveforms(SAMP_FREQ, dtype)
+
+    def _render(self, dtype):
+        envelope_cache.clear()
+        self.sequence._changed = True
+        self.sequence.waveforms(SAMP_FREQ, dtype)
+
+    def time_waveforms(self, n_pulses, dtype):
+        self._render(dtype)
+
+    def peakmem_waveforms(self, n_pulses, dtype):
+        self._render(dtype)
+
+
+class ParallelWaveforms(Waveforms):
+    # the channels rendered on a thread pool
+    params = ([1000, 10000], [8], [False])
+
+    def setup(self, n_pulses, n_channels, sweepable):
+        self.executor = ThreadPoolExecutor(n_channels)
+        super().setup(n_pulses, n_channels, sweepable)
+        self.sequence.executor = self.executor
+
+    def teardown(self, *params):
+        self.executor.shutdown()
+
+
+class SweepUpdate:
+    # render again after changing one sweepable, as in a sweep
+    params = [100, 1000, 10000]
+    param_names = ["n_pulses"]
+    timeout = 300
+
+    def setup(self, n_pulses):
+        self.sequence = gate_sequence(n_pulses, 8, sweepable=True)
+        self.sequence.waveforms(SAMP_FREQ)
+        self.value = 0.5
+
+    def time_subs_waveforms(self, n_pulses):
+        self.value = 1 - self.value
+        self.sequence.subs("amp", self.value)
+        self.sequence.waveforms(SAMP_FREQ)
+
+    def time_render_sweep(self, n_pulses):
+        self.sequence.render_sweep({"amp": np.linspace(0, 1, 21)}, SAMP_FREQ)
+
+
+class SweepUpdateInto:
+    # as SweepUpdate, rendered into a preallocated buffer, e.g. in shared memory
+    params = ([1000, 10000], [False, True])
+    param_names = ["n_pulses", "memmap"]
+    timeout = 300
+
+    def setup(self, n_pulses, memmap):
+        self.sequence = gate_sequence(n_pulses, 8, sweepable=True)
+        shape = (8, self.sequence.length())
+        if memmap:
+            self.directory = tempfile.TemporaryDirectory()
+            path = os.path.join(self.directory.name, "waveforms.dat")
+            self.out = np.memmap(path, dtype=np.float64, mode="w+", shape=shape)
+        else:
+            self.out = np.empty(shape)
+        self.sequence.waveforms(SAMP_FREQ, out=self.out)
+        self.value = 0.5
+
+    def teardown(self, n_pulses, memmap):
+        del self.out
+        if memmap:
+            self.directory.cleanup()
+
+    def _update(self):
+        self.value = 1 - self.value
+        self.sequence.subs("amp", self.value)
+        self.sequence.waveforms(SAMP_FREQ, out=self.out)
+
+    def time_subs_waveforms(self, *params):
+        self._update()
+
+    def peakmem_subs_waveforms(self, *params):
+        self._update()
+
+
+class StaticWaveforms:
+    params = [10, 100]
+    param_names = ["n_pulses"]
+
+    def setup(self, n_pulses):
+        self.sequence = static.Sequence(2)
+        for i in range(n_pulses):
+            pulse = static.Gaussian(20e-9) * 0.5 + static.Drag(20e-9) * 0.1
+            self.sequence.register(
+                i * 30e-9, pulse, frequency=100e6, phase=0, channel=i % 2
+            )
+
+    def time_waveforms(self, n_pulses):
+        self.sequence.waveforms(SAMP_FREQ)
+
+    def peakmem_waveforms(self, n_pulses):
+        self.sequence.waveforms(SAMP_FREQ)
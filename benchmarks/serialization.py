@@ -0,0 +1,50 @@
+import os
+import tempfile
+from seqpy import Sequence
+from seqpy.utils.rendered import load_rendered
+from .common import gate_sequence
+
+
+class DumpLoad:
+    params = ([10, 100, 1000], [False, True])
+    param_names = ["n_pulses", "sweepable"]
+    timeout = 300
+
+    def setup(self, n_pulses, sweepable):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "sequence.json")
+        self.sequence = gate_sequence(n_pulses, 2, sweepable)
+        self.sequence.dump(self.path)
+
+    def teardown(self, n_pulses, sweepable):
+        self.directory.cleanup()
+
+    def time_dump(self, n_pulses, sweepable):
+        self.sequence.dump(self.path)
+
+    def time_load(self, n_pulses, sweepable):
+        Sequence().load(self.path)
+
+    def peakmem_load(self, n_pulses, sweepable):
+        Sequence().load(self.path)
+
+
+class ExportLoadRendered:
+    params = [10, 100, 1000]
+    param_names = ["n_pulses"]
+    timeout = 300
+
+    def setup(self, n_pulses):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "rendered")
+        self.sequence = gate_sequence(n_pulses, 2, True)
+        self.sequence.export_rendered(self.path, 2.4e9, {"amp": 0.5})
+
+    def teardown(self, n_pulses):
+        self.directory.cleanup()
+
+    def time_export_rendered(self, n_pulses):
+        self.sequence.export_rendered(self.path, 2.4e9, {"amp": 0.5})
+
+    def time_load_rendered(self, n_pulses):
+        load_rendered(self.path)
@@ -0,0 +1,89 @@
+import numpy as np
+from seqpy import Sequence, Gaussian, Carrier
+from seqpy.utils.zhinst_helpers import (
+    find_active_time,
+    seqc_generation,
+    prepare_zhinst_hdawg,
+    prepare_zhinst_hdawg_streamed,
+    prepare_zhinst_hdawg_segments,
+)
+
+
+def sparse_waveforms(n_samples, n_channels, n_segments):
+    # zeros with n_segments short bursts, far enough apart to be separate segments
+    waveforms = np.zeros((n_channels, n_samples))
+    starts = np.linspace(0, n_samples - 1024, n_segments).astype(int) // 16 * 16
+    for start in starts:
+        waveforms[:, start : start + 480] = 0.5
+    return waveforms
+
+
+class FindActiveTime:
+    params = ([100_000, 2_400_000, 24_000_000], [1, 8])
+    param_names = ["n_samples", "n_channels"]
+    timeout = 300
+
+    def setup(self, n_samples, n_channels):
+        self.waveforms = list(sparse_waveforms(n_samples, n_channels, 200))
+
+    def time_find_active_time(self, n_samples, n_channels):
+        find_active_time(self.waveforms)
+
+    def peakmem_find_active_time(self, n_samples, n_channels):
+        find_active_time(self.waveforms)
+
+
+class SeqcGeneration:
+    params = ([10, 100, 1000, 10000], [2, 8])
+    param_names = ["n_segments", "n_channels"]
+    timeout = 300
+
+    def setup(self, n_segments, n_channels):
+        self.active_times = [(i * 8000, i * 8000 + 480) for i in range(n_segments)]
+        self.total_length = n_segments * 8000
+        self.period = self.total_length + 8000
+
+    def time_seqc_generation(self, n_segments, n_channels):
+        seqc_generation(
+            self.active_times, n_channels, self.total_length, -1, self.period
+        )
+
+
+def sparse_sequence(duration, n_channels, n_pulses):
+    # n_pulses short pulses spread over duration (in second) on every channel
+    sequence = Sequence(n_channels)
+    for i in range(n_pulses):
+        for ch in range(n_channels):
+            sequence.register(
+                i * duration / n_pulses,
+                Gaussian(20e-9),
+                Carrier(100e6 + 10e6 * ch, 0),
+                channel=ch,
+            )
+    return sequence
+
+
+class PrepareLongSequence:
+    # a 2 ms sequence on 8 channels, rendered as a whole, in chunks or by segments
+    params = ["dense", "chunks", "segments"]
+    param_names = ["method"]
+    timeout = 300
+
+    def setup(self, method):
+        self.sequence = sparse_sequence(2e-3, 8, 100)
+
+    def _prepare(self, method):
+        if method == "dense":
+            prepare_zhinst_hdawg(self.sequence, 3e-3, dtype=np.int16)
+        elif method == "chunks":
+            prepare_zhinst_hdawg_streamed(
+                self.sequence, 3e-3, dtype=np.int16, chunk_size=2**20
+            )
+        else:
+            prepare_zhinst_hdawg_segments(self.sequence, 3e-3, dtype=np.int16)
+
+    def time_prepare(self, method):
+        self._prepare(method)
+
+    def peakmem_prepare(self, method):
+        self._prepare(method)
@@ -1,4 +1,34 @@
-from .pulses import sweepables, Carrier, Gaussian, Drag, Rect, Ramp, Cosine
-from .sequence import Sequence
-from .utils.zhinst_helpers import update_zhinst_hdawg, update_zhinst_uhfqa
-from .utils.iq_adjusting import IQShifter
+import importlib
+
+# the names are imported from their module when first used, so that importing seqpy
+# does not pay for sympy, matplotlib, scipy or zhinst.toolkit before they are needed
+_lazy_names = {
+    "sweepables": ".pulses",
+    "Carrier": ".pulses",
+    "Gaussian": ".pulses",
+    "Drag": ".pulses",
+    "Rect": ".pulses",
+    "Ramp": ".pulses",
+    "Cosine": ".pulses",
+    "envelope_cache": ".pulses",
+    "Sequence": ".sequence",
+    "Profiler": ".utils.profiling",
+    "update_zhinst_hdawg": ".utils.zhinst_helpers",
+    "update_zhinst_uhfqa": ".utils.zhinst_helpers",
+    "prepare_zhinst_hdawg": ".utils.zhinst_helpers",
+    "upload_zhinst_hdawg": ".utils.zhinst_helpers",
+    "IQShifter": ".utils.iq_adjusting",
+}
+__all__ = list(_lazy_names)
+
+
+def __getattr__(name):
+    if name not in _lazy_names:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_lazy_names[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_lazy_names))
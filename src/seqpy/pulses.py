@@ -1,7 +1,9 @@
-from sympy import Symbol, Expr, symbols
+from sympy import S, Symbol, Expr, symbols, lambdify
 from sympy.functions import Max, Min
+from sympy.printing.pycode import PythonCodePrinter
 from .utils.math_util import *
-import copy
+from .utils.envelope_cache import EnvelopeCache
+from functools import lru_cache
 import os
 
 
@@ -21,9 +23,47 @@ def sweepables(names):
         return [Sweepable(sym.name) for sym in syms]
 
 
+class _ExactFloatPrinter(PythonCodePrinter):
+    # print floats with all their digits, so compiled expressions give the same numbers as subs
+    def _print_Float(self, expr):
+        return repr(float(expr))
+
+
+def _number(value):
+    return int(value) if value.is_Integer else float(value)
+
+
+@lru_cache(maxsize=2**16)
+def compile_expr(expr):
+    # compile a sympy expression once into a python function of its free symbols
+    syms = sorted(expr.free_symbols, key=lambda s: s.name)
+    terms = expr.as_coefficients_dict()
+    if all(k == 1 or k.is_Symbol for k in terms) and all(
+        v.is_Number for v in terms.values()
+    ):
+        # linear expressions (e.g. positions) are common, skip the costly lambdify
+        const = _number(terms[S.One]) if S.One in terms else 0
+        coefs = [_number(terms[sym]) for sym in syms]
+
+        def func(*values):
+            return const + sum(c * v for c, v in zip(coefs, values))
+
+    else:
+        func = lambdify(syms, expr, modules="math", printer=_ExactFloatPrinter)
+    return tuple(s.name for s in syms), func
+
+
+def expr_names(expr):
+    # names of all sweepables an expression (or a list of them) depends on
+    if hasattr(expr, "__iter__"):
+        return set().union(*[expr_names(e) for e in expr])
+    return {s.name for s in expr.free_symbols} if isinstance(expr, Expr) else set()
+
+
 class SweepableExpr:
     def __init__(self) -> None:
         self._sweepable_mapping = dict()
+        self._value_cache = dict()
 
     def retrieve_value(self, expr):
         if hasattr(expr, "__iter__"):
@@ -31,24 +71,29 @@ class SweepableExpr:
         else:
             if not isinstance(expr, Expr):
                 return expr
+            elif expr in self._value_cache:
+                return self._value_cache[expr]
             else:
-                for k in expr.atoms(Symbol):
-                    # default value is 0
-                    v = (
-                        self._sweepable_mapping[k.name]
-                        if k.name in self._sweepable_mapping
-                        else 0
-                    )
-                    expr = expr.subs(k, v)
-                if "Int" in str(type(expr)):
-                    expr = int(expr)
-                else:
-                    expr = float(expr)  # Float or Infinity
-                return expr
+                names, func = compile_expr(expr)
+                # default value is 0
+                value = func(*[self._sweepable_mapping.get(n, 0) for n in names])
+                # Integer or Float / Infinity
+                value = value if isinstance(value, int) else float(value)
+                self._value_cache[expr] = value
+                return value
 
     def subs(self, sym, value):
         name = sym.name if isinstance(sym, Expr) else sym
+        if name in self._sweepable_mapping and self._sweepable_mapping[name] == value:
+            return
         self._sweepable_mapping[name] = value
+        # forget the cached values depending on this sweepable
+        for expr in [e for e in self._value_cache if name in compile_expr(e)[0]]:
+            del self._value_cache[expr]
+
+
+# a sweepable without value, see Pulse.subs
+_unset = object()
 
 
 class Pulse(SweepableExpr):
@@ -74,8 +119,17 @@ class Pulse(SweepableExpr):
             waveform = np.append(waveform, np.zeros(right - self.right))
         return waveform
 
+    def _derive(self):
+        # a new node sharing its children and parameters with this one, nodes are never copied
+        # deeply, and the shared ones are not changed in place, see subs
+        new = object.__new__(type(self))
+        new.__dict__.update(self.__dict__)
+        new._sweepable_mapping = dict(self._sweepable_mapping)
+        new._value_cache = dict(self._value_cache)
+        return new
+
     def shift(self, length: int):
-        new = copy.deepcopy(self)
+        new = self._derive()
         new._displacement += length
         new._left += length
         new._right += length
@@ -90,7 +144,7 @@ class Pulse(SweepableExpr):
                 children=[self, other],
             )
         else:
-            new = copy.deepcopy(self)
+            new = self._derive()
             new._offset += other
             return new
 
@@ -106,7 +160,7 @@ class Pulse(SweepableExpr):
                 children=[self, other],
             )
         else:
-            new = copy.deepcopy(self)
+            new = self._derive()
             new._gain *= other
             return new
 
@@ -129,36 +183,58 @@ class Pulse(SweepableExpr):
 
     @property
     def waveform(self):
+        if self.left > self.right:
+            return np.array([])
+        return self.compile().render(self.left, self.right)
+
+    def compile(self, samp_freq=None):
+        # lower the pulse tree into a flat plan of products of shapes on their own ranges
+        samp_freq = self.samp_freq if samp_freq is None else samp_freq
+        plan = Plan(samp_freq)
+        self._lower(plan.terms, 1, 0, self._window(0, samp_freq), samp_freq)
+        return plan
+
+    def _lower(self, terms, coef, displacement, clip, samp_freq):
+        # displacement of the parents (in time), the terms are clipped to the range of the parents
+        left, right = self._window(displacement, samp_freq)
+        left, right = max(left, clip[0]), min(right, clip[1])
+        if left >= right:
+            return
+        gain, offset = coef * self.gain, coef * self.offset
+        displacement = displacement + self.displacement
         if self.is_atom:
-            if self.left > self.right:
-                return np.array([])
-            x = (
-                np.arange(self.left, self.right) - self.displacement * self.samp_freq
-            )  # in sample
-            return self._waveform(x) * self.gain + self.offset
-        else:
-            # -------------- Tree traversing --------------
-            child1, child2 = [c.shift(self.displacement) for c in self.children]
-            for child in (child1, child2):
-                child.samp_freq = self.samp_freq
-            wf1 = child1._pad(child1.waveform, self.left, self.right)
-            wf2 = child2._pad(child2.waveform, self.left, self.right)
-            if self.type == "add":
-                return (wf1 + wf2) * self.gain + self.offset
-            elif self.type == "mul":
-                return (wf1 * wf2) * self.gain + self.offset
+            x0 = displacement * samp_freq  # in sample
+            terms.append((gain, left, right, ((self, x0, self.extra_params),)))
+        elif self.type == "add":
+            for child in self.children:
+                child._lower(terms, gain, displacement, (left, right), samp_freq)
+        elif self.type == "mul":
+            child_terms = [list(), list()]
+            for child, t in zip(self.children, child_terms):
+                child._lower(t, 1, displacement, (left, right), samp_freq)
+            for c1, l1, r1, f1 in child_terms[0]:
+                for c2, l2, r2, f2 in child_terms[1]:
+                    l, r = max(l1, l2), min(r1, r2)
+                    if l < r:
+                        terms.append((gain * c1 * c2, l, r, f1 + f2))
+        if offset:
+            terms.append((offset, left, right, ()))
+
+    def _window(self, displacement, samp_freq):
+        # range in samples after shifting by displacement (in time)
+        left = self.retrieve_value(self._left) + displacement
+        right = self.retrieve_value(self._right) + displacement
+        left = left if np.isinf(left) else round(left * samp_freq)
+        right = right if np.isinf(right) else round(right * samp_freq) + 1
+        return left, right
 
     @property
     def left(self):
-        left_val = self.retrieve_value(self._left)
-        return left_val if np.isinf(left_val) else round(left_val * self.samp_freq)
+        return self._window(0, self.samp_freq)[0]
 
     @property
     def right(self):
-        right_val = self.retrieve_value(self._right)
-        return (
-            right_val if np.isinf(right_val) else round(right_val * self.samp_freq) + 1
-        )
+        return self._window(0, self.samp_freq)[1]
 
     @property
     def samp_freq(self):
@@ -181,12 +257,38 @@ class Pulse(SweepableExpr):
         return self.retrieve_value(self._offset)
 
     def _waveform(self, x):
+        return self._shape(x, self.extra_params, self.samp_freq)
+
+    def _shape(self, x, params, samp_freq):
         return np.zeros(len(x))
 
     def subs(self, name, value):
         super().subs(name, value)
+        # the children could be shared with other pulses (see _derive), they are never
+        # changed in place but replaced by substituted copies, unless they have the value
+        name = name.name if isinstance(name, Expr) else name
+        children = list()
+        for child in self.children:
+            if child._sweepable_mapping.get(name, _unset) != value:
+                child = child._derive()
+                child.subs(name, value)
+            children.append(child)
+        self.children = children
+
+    def sweepable_names(self):
+        names = expr_names(
+            [
+                self._left,
+                self._right,
+                self._gain,
+                self._offset,
+                self._displacement,
+                self._extra_params,
+            ]
+        )
         for child in self.children:
-            child.subs(name, value)
+            names |= child.sweepable_names()
+        return names
 
     # ----------- For dumping waveforms information -----------
 
@@ -198,7 +300,7 @@ class Pulse(SweepableExpr):
         dumped["offset"] = str(self._offset)
         dumped["displacement"] = str(self._displacement)
         dumped["extra params"] = [str(p) for p in self._extra_params]
-        dumped["children"] = [c.dump for c in self.children]
+        dumped["children"] = [c.dump() for c in self.children]
         return dumped
 
     @property
@@ -210,6 +312,74 @@ class Pulse(SweepableExpr):
         return []
 
 
+# ------------------------------------------------
+#
+#        Flattened evaluation plan
+#
+# ------------------------------------------------
+
+
+# rendered envelopes of atomic pulses, shared by all plans
+envelope_cache = EnvelopeCache()
+
+
+class Plan:
+    def __init__(self, samp_freq) -> None:
+        self.samp_freq = samp_freq
+        # terms of (coefficient, left, right, factors), each factor being (pulse, x0, params)
+        # the term is the product of all factors on [left, right), constant if no factor
+        self.terms = list()
+
+    def add(self, pulse, displacement=0, carrier=None):
+        # lower the pulse shifted by displacement (in time) and modulated by the carrier
+        window = pulse._window(displacement, self.samp_freq)
+        if carrier is None:
+            pulse._lower(self.terms, 1, displacement, window, self.samp_freq)
+        else:
+            terms = list()
+            pulse._lower(terms, 1, displacement, window, self.samp_freq)
+            factor = (carrier, 0, carrier.extra_params)
+            self.terms += [(c, l, r, (factor,) + f) for c, l, r, f in terms]
+        return window
+
+    def render(self, left, right, out=None):
+        # accumulate all the terms into a buffer covering [left, right)
+        # the terms are clipped to [left, right), e.g. to render a chunk of a long pulse
+        if out is None:
+            out = np.zeros(right - left)
+        for coef, l, r, factors in self.terms:
+            l, r = max(l, left), min(r, right)
+            if l >= r:
+                continue
+            values = coef
+            for pulse, x0, params in factors:
+                if isinstance(pulse, Carrier):
+                    shape = pulse._shape(np.arange(l, r), params, self.samp_freq)
+                elif type(pulse)._waveform is not Pulse._waveform:
+                    shape = self._waveform(pulse, l - x0, r - l)
+                else:
+                    shape = self._envelope(pulse, l - x0, r - l, params)
+                values = values * shape
+            out[l - left : r - left] += values
+        return out
+
+    def _waveform(self, pulse, start, length):
+        # a pulse defining its samples with _waveform(x) instead of _shape, as before the
+        # plans, it could depend on anything and is not cached
+        pulse = pulse._derive()
+        pulse.samp_freq = self.samp_freq
+        return pulse._waveform(np.arange(length) + start)
+
+    def _envelope(self, pulse, start, length, params):
+        # the samples of an atomic pulse only depend on its parameters and on where the samples
+        # fall relative to its center, sub-sample offsets are resolved to 1e-9 samples
+        start = round(start, 9)  # in sample
+        key = (type(pulse), tuple(params), self.samp_freq, start, length)
+        return envelope_cache.get(
+            key, lambda: pulse._shape(np.arange(length) + start, params, self.samp_freq)
+        )
+
+
 # ------------------------------------------------
 #
 #        Carrier as a special Pulse
@@ -223,15 +393,20 @@ class Carrier(Pulse):
         self.frequency = frequency
         self.phase = phase
 
-    def _waveform(self, x):
-        x = x / self.samp_freq
-        frequency, phase = self.extra_params
+    def _shape(self, x, params, samp_freq):
+        x = x / samp_freq
+        frequency, phase = params
         phase_in_rad = phase * np.pi / 180
         return np.cos(2 * np.pi * frequency * x + phase_in_rad)
 
     def _pad(self, waveform, left, right):
         return self._waveform(np.arange(left, right))
 
+    def _lower(self, terms, coef, displacement, clip, samp_freq):
+        # a carrier is referenced to the absolute time and spans the whole range of its parent
+        if -np.inf < clip[0] < clip[1] < np.inf:
+            terms.append((coef, clip[0], clip[1], ((self, 0, self.extra_params),)))
+
     @property
     def _extra_params(self):
         return [self.frequency, self.phase]
@@ -252,8 +427,8 @@ class Gaussian(Pulse):
         right = -left
         super().__init__(left, right)
 
-    def _waveform(self, x):
-        return gauss(x, *np.array(self.extra_params) * self.samp_freq)
+    def _shape(self, x, params, samp_freq):
+        return gauss(x, *np.array(params) * samp_freq)
 
     @property
     def _extra_params(self):
@@ -267,8 +442,8 @@ class Drag(Pulse):
         right = -left
         super().__init__(left, right)
 
-    def _waveform(self, x):
-        return drag(x, *np.array(self.extra_params) * self.samp_freq)
+    def _shape(self, x, params, samp_freq):
+        return drag(x, *np.array(params) * samp_freq)
 
     @property
     def _extra_params(self):
@@ -282,8 +457,8 @@ class Rect(Pulse):
         right = -left
         super().__init__(left, right)
 
-    def _waveform(self, x):
-        return rectangle(x, *np.array(self.extra_params) * self.samp_freq)
+    def _shape(self, x, params, samp_freq):
+        return rectangle(x, *np.array(params) * samp_freq)
 
     @property
     def _extra_params(self):
@@ -299,8 +474,8 @@ class Cosine(Pulse):
         self.is_atom = True
         super().__init__(left, right)
 
-    def _waveform(self, x):
-        return cos(x, *np.array(self.extra_params) * self.samp_freq)
+    def _shape(self, x, params, samp_freq):
+        return cos(x, *np.array(params) * samp_freq)
 
     @property
     def _extra_params(self):
@@ -319,8 +494,8 @@ class Ramp(Pulse):
         self.is_atom = True
         super().__init__(left, right)
 
-    def _waveform(self, x):
-        return ramp(x, *np.array(self.extra_params) * self.samp_freq)
+    def _shape(self, x, params, samp_freq):
+        return ramp(x, *np.array(params) * samp_freq)
 
     @property
     def _extra_params(self):
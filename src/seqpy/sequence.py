@@ -1,11 +1,37 @@
-from .pulses import Pulse, Carrier, Sweepable, SweepableExpr
+from .pulses import Pulse, Carrier, Plan, Sweepable, SweepableExpr, expr_names
 from .utils.pulse_reconstruction import reconstruct, str2expr, collect_sym
+from .utils.profiling import Profiler, null_profiler
+from .utils.rendered import save_rendered
+from contextlib import contextmanager
+from collections import OrderedDict
+from sympy import Expr
 import numpy as np
-import matplotlib.pyplot as plt
+import copy
+import hashlib
 import json
 
+# parsed sequence files by the hash of their content, see Sequence.load
+load_cache = OrderedDict()
+load_cache_size = 16
+# the dtypes waveforms() could return, int16 is scaled to the full range of the devices
+output_dtypes = [np.dtype(np.float64), np.dtype(np.float32), np.dtype(np.int16)]
+int16_full_scale = 2**15 - 1
+# the marker bits of the awg cores are packed in one uint16, 4 bits for each core,
+# see Sequence.set_marker and markers()
+marker_bits_per_core = 4
+n_marker_cores = 4
+# in samples, int16 waveforms are clipped by blocks of this size, see Sequence._clip_into
+clip_block_size = 2**16
+# a sweepable without value at the last rendering, see Sequence.subs
+_unrendered = object()
+
 
 class Sequence(SweepableExpr):
+    # records the timing of the rendering stages, see profile()
+    profiler = null_profiler
+    # renders the channels in parallel if set, e.g. a concurrent.futures.ThreadPoolExecutor
+    executor = None
+
     def __init__(self, n_channels: int = 1):
         super().__init__()
         n_channels = int(n_channels)
@@ -13,14 +39,33 @@ class Sequence(SweepableExpr):
             raise Exception("n_channels could only be a postive integer")
         self._pulses = list()
         [self._pulses.append(list()) for i in range(n_channels)]
+        # for each registered pulse: names of the sweepables it depends on
+        self._dependencies = [list() for i in range(n_channels)]
+        # for each registered pulse: (left, waveform) of its last rendering
+        self._rendered = [list() for i in range(n_channels)]
+        self._dirty = set()
+        # values of the sweepables at the last rendering
+        self._rendered_mapping = dict()
+        # content hash of the loaded file, while the sequence is not modified
+        self._loaded = None
         self._trigger_pos = [0]
         self._marker_width = 100 / 2.4e9  # default value
+        # the other marker bits, {(bit, core): (positions, width)}, see set_marker
+        self._markers = dict()
+        # (key, marker bits) of the last markers()
+        self._marker_cache = None
         self.left = 0
         self.right = 0
         self._changed = False
         self._waveforms = list()
+        self._uncapped = np.zeros((n_channels, 0))
         self._samp_freq = 2.4e9
         self._cached_samp_freq = 0
+        self._dtype = np.dtype(np.float64)  # of the waveforms
+        # the dtype or the out buffer changed, the waveforms are accumulated again
+        self._output_changed = False
+        # the buffer given to waveforms(out=...), rendered into in place
+        self._out = None
         [self._waveforms.append(np.array([])) for i in range(n_channels)]
 
     def register(
@@ -30,16 +75,31 @@ class Sequence(SweepableExpr):
             if frequency is None or phase is None:
                 raise Exception("Please provide information for carrier!")
             carrier = Carrier(frequency, phase)
+        # the values of the sweepables are bound to the registered pulses, see _push,
+        # every sequence gets its own root, the shared children are not changed by subs
+        pulse, carrier = pulse._derive(), carrier._derive()
+        dependencies = (
+            expr_names(position) | pulse.sweepable_names() | carrier.sweepable_names()
+        )
         if not channel and not isinstance(channel, int):
-            for c in self._pulses:
+            for c, d in zip(self._pulses, self._dependencies):
                 c.append((position, pulse, carrier))
+                d.append(dependencies)
         else:
             self._pulses[channel].append((position, pulse, carrier))
+            self._dependencies[channel].append(dependencies)
         self._changed = True
+        self._loaded = None
 
     def subs(self, sym, value):
+        name = sym.name if isinstance(sym, Expr) else sym
         super().subs(sym, value)
-        self._changed = True
+        # dirty if the value differs from the one used for the last rendering, or if it
+        # had none, the registered pulses could have their own
+        if self._rendered_mapping.get(name, _unrendered) != value:
+            self._dirty.add(name)
+        else:
+            self._dirty.discard(name)
 
     @property
     def trigger_pos(self):
@@ -50,62 +110,595 @@ class Sequence(SweepableExpr):
         # position: either list or float, will be converted to a iterable object anyway
         position = [position] if not hasattr(position, "__iter__") else position
         self._trigger_pos = position
+        self._changed = True
+
+    def set_marker(self, bit, positions, width=100 / 2.4e9, core=None):
+        # the marker bit (1 to 3) is high for width (in second) from each of the positions
+        # on the awg core (0 to 3, channels 2 * core and 2 * core + 1), or all of them if None
+        # bit 0 is the one of trigger_pos and marker_width, on all the cores
+        # None positions removes the marker
+        # on the HDAWG, bits 0 and 1 are the markers of the first output of a core,
+        # bits 2 and 3 the ones of the second output
+        if bit not in (1, 2, 3):
+            raise Exception(
+                "the marker bit should be 1, 2 or 3, bit 0 is set by trigger_pos and marker_width."
+            )
+        if core is not None and core not in range(n_marker_cores):
+            raise Exception(
+                f"the core should be None or 0 to {n_marker_cores - 1}, not {core}."
+            )
+        if positions is None:
+            self._markers.pop((bit, core), None)
+        else:
+            positions = [positions] if not hasattr(positions, "__iter__") else positions
+            self._markers[(bit, core)] = (list(positions), width)
+        self._changed = True
+        self._loaded = None
 
     def length(self):
-        return len(self.waveforms()[0])
+        self._update(self.samp_freq)
+        return self.right - self.left
 
-    def waveforms(self, samp_freq):
+    @contextmanager
+    def profile(self, profiler=None):
+        # record the timing of the stages within the block, yields the profiler
+        profiler = Profiler() if profiler is None else profiler
+        previous, self.profiler = self.profiler, profiler
+        try:
+            yield profiler
+        finally:
+            self.profiler = previous
+
+    def waveforms(self, samp_freq, dtype=None, out=None):
+        # dtype: one of output_dtypes, float32 and int16 are accumulated in float32
+        # int16 is scaled and truncated like zhinst does with float waveforms
+        # the returned arrays keep their values, the next renderings write to new ones
+        # out: an array of shape (n_channels, length()), e.g. in shared memory or a memmap,
+        # rendered into in place and returned, the waveforms are kept there by the next
+        # calls with the same out, only the changed samples are written again
+        if dtype is None:
+            dtype = np.float64 if out is None else out.dtype
+        dtype = self._output_dtype(dtype)
+        if out is not None:
+            if out.dtype != dtype:
+                raise Exception(f"out is {out.dtype}, the waveforms are {dtype}.")
+            if out.ndim != 2 or len(out) != len(self._pulses):
+                raise Exception(
+                    f"out should be of shape (n_channels, n_samples), "
+                    f"with {len(self._pulses)} channels, not {out.shape}."
+                )
+        with self.profiler.stage("waveforms") as counts:
+            if dtype != self._dtype:
+                self._dtype = dtype
+                self._output_changed = True
+            if out is not self._out:
+                # the previous buffer is not written anymore
+                self._out = out
+                self._output_changed = True
+            self._update(samp_freq)
+            counts["samples"] += self._uncapped.size
+        return self._waveforms if out is None else out
+
+    @staticmethod
+    def _output_dtype(dtype):
+        dtype = np.dtype(dtype)
+        if dtype not in output_dtypes:
+            raise Exception(
+                f"unsupported dtype {dtype}, the waveforms could be float64, float32 or int16."
+            )
+        return dtype
+
+    def _update(self, samp_freq):
         self.samp_freq = samp_freq
         freq_changed_flag = False
         if self.samp_freq != self._cached_samp_freq:
             freq_changed_flag = True
             self._cached_samp_freq = self.samp_freq
         if self._changed or freq_changed_flag:
-            waveforms = list()
-            for channel in self._pulses:
-                base = Pulse(left=np.inf, right=-np.inf)
-                for position, pulse, carrier in channel:
-                    shifting_amount = self.retrieve_value(position)  # in time
-                    shifted = pulse.shift(shifting_amount)  # in time
-                    base += carrier * shifted
-                waveforms.append(base)
-            # update values of sweepables and sampling frequencies
-            for wf in waveforms:
-                wf.samp_freq = self.samp_freq
-                for k, v in self._sweepable_mapping.items():
-                    wf.subs(k, v)
-            # padding all channels to have the same length
-            left = np.inf
-            right = -np.inf
-            for wf in waveforms:
-                if wf.left < left:
-                    left = wf.left
-                if wf.right > right:
-                    right = wf.right
-            # the range should include trigger position
-            trig_pos = np.round(self.trigger_pos * self.samp_freq)  # in samples
-            trig_left = np.min(trig_pos) - 1  # in samples
-            trig_right = (
-                np.max(trig_pos) + self.marker_width * self.samp_freq
-            )  # in samples
-            left = int(min(left, trig_left))
-            right = int(max(right, trig_right))
-            # padded to make the waveform to align with 16 samples (artifacts of zhinst)
-            right += (left - right) % 16
-            wf_data = [wf._pad(wf.waveform, left, right) for wf in waveforms]
+            self._render_all()
+            return
+        if self._output_changed:
+            self._accumulate_all()
+        if self._dirty:
+            self._render_dirty()
+
+    def _render_all(self):
+        with self.profiler.stage("evaluate"):
+            self._push(self._sweepable_mapping)
+            if self.executor is None:
+                plans = [
+                    [self._plan_entry(*entry, self._sweepable_mapping) for entry in c]
+                    for c in self._pulses
+                ]
+        with self.profiler.stage("render") as counts:
+            if self.executor is None:
+                self._rendered = [
+                    [self._render_plan(*plan) for plan in channel] for channel in plans
+                ]
+            else:
+                # evaluated and rendered together, one channel per task
+                self._rendered = list(
+                    self.executor.map(self._render_channel, self._pulses)
+                )
+            for rendered in self._rendered:
+                counts["samples"] += sum(len(wf) for _, wf in rendered)
+                counts["bytes"] += sum(wf.nbytes for _, wf in rendered)
+        self._accumulate_all()
+        self._changed = False
+        self._dirty = set()
+        self._rendered_mapping = dict(self._sweepable_mapping)
+
+    def _accumulate_all(self):
+        with self.profiler.stage("pad and clip") as counts:
+            left, right = self._range()
+            shape = (len(self._pulses), right - left)
+            if self._out is not None and self._out.shape != shape:
+                # e.g. the range changed, the next calls render without it
+                out_shape, self._out = self._out.shape, None
+                self._changed = True
+                raise Exception(
+                    f"out is of shape {out_shape}, the waveforms are {shape}, see length()."
+                )
             self.right = right  # in sample
             self.left = left  # in sample
-            self._waveforms = [self._cap(wf) for wf in wf_data]
-            self._changed = False
-        return self._waveforms
+            # every channel is accumulated and clipped into its own row
+            accumulator = np.float64 if self._dtype == np.float64 else np.float32
+            if self._uncapped.shape == shape and self._uncapped.dtype == accumulator:
+                self._uncapped.fill(0)
+            else:
+                self._uncapped = np.zeros(shape, dtype=accumulator)
+            if self._out is None:
+                self._waveforms = list(np.empty(shape, dtype=self._dtype))
+            else:
+                self._waveforms = list(self._out)
+            channels = range(len(self._pulses))
+            if self.executor is None:
+                list(map(self._accumulate, channels))
+            else:
+                list(self.executor.map(self._accumulate, channels))
+            counts["samples"] += self._uncapped.size
+            counts["bytes"] += self._uncapped.nbytes
+        self._output_changed = False
+
+    def _render_channel(self, channel):
+        return [
+            self._render_entry(*entry, self._sweepable_mapping) for entry in channel
+        ]
+
+    def _accumulate(self, ch):
+        data = self._uncapped[ch]
+        for l, wf in self._rendered[ch]:
+            data[l - self.left : l - self.left + len(wf)] += wf
+        self._clip(ch, 0, len(data))
+
+    def _render_dirty(self):
+        # only re-render the pulses depending on the changed sweepables
+        dirty, self._dirty = self._dirty, set()
+        if dirty & expr_names(
+            [self._trigger_pos, self._marker_width, list(self._markers.values())]
+        ):
+            return self._render_all()
+        updated = list()  # (channel, index, previous left, previous right)
+        for ch, dependencies in enumerate(self._dependencies):
+            for i, names in enumerate(dependencies):
+                if names & dirty:
+                    l, wf = self._rendered[ch][i]
+                    updated.append((ch, i, l, l + len(wf)))
+        with self.profiler.stage("evaluate"):
+            mapping = {k: self._sweepable_mapping[k] for k in dirty}
+            self._push(mapping, [self._pulses[ch][i] for ch, i, _, _ in updated])
+            self._rendered_mapping.update(mapping)
+            plans = [
+                self._plan_entry(*self._pulses[ch][i], self._sweepable_mapping)
+                for ch, i, _, _ in updated
+            ]
+        with self.profiler.stage("render") as counts:
+            for (ch, i, _, _), plan in zip(updated, plans):
+                l, wf = self._rendered[ch][i] = self._render_plan(*plan)
+                counts["samples"] += len(wf)
+                counts["bytes"] += wf.nbytes
+        if self._range() != (self.left, self.right):
+            return self._render_all()
+        # re-accumulate the touched ranges of the touched channels only
+        with self.profiler.stage("pad and clip") as counts:
+            if self._out is None:
+                # the returned waveforms keep their values, the touched channels are copied
+                self._waveforms = list(self._waveforms)
+                for ch in {ch for ch, _, _, _ in updated}:
+                    self._waveforms[ch] = self._waveforms[ch].copy()
+                    counts["bytes"] += self._waveforms[ch].nbytes
+            for ch, i, l_prev, r_prev in updated:
+                l, wf = self._rendered[ch][i]
+                left, right = min(l, l_prev), max(l + len(wf), r_prev)
+                self._patch(ch, left, right)
+                counts["samples"] += max(right - left, 0)
+
+    def _patch(self, ch, left, right):
+        # accumulate again all pulses of a channel overlapping [left, right) (in samples)
+        data = self._uncapped[ch]
+        data[left - self.left : right - self.left] = 0
+        for l, wf in self._rendered[ch]:
+            start, end = max(l, left), min(l + len(wf), right)
+            if start < end:
+                data[start - self.left : end - self.left] += wf[start - l : end - l]
+        self._clip(ch, left - self.left, right - self.left)
+
+    def _clip(self, ch, start, end):
+        # clip the accumulated samples [start, end) (from left) into the waveform
+        self._clip_into(self._uncapped[ch][start:end], self._waveforms[ch][start:end])
 
     @staticmethod
-    def _cap(waveform):
-        max_cap = np.ones(len(waveform))
-        min_cap = -max_cap
-        return np.minimum(np.maximum(waveform, min_cap), max_cap)
+    def _clip_into(data, out):
+        if out.dtype == np.int16:
+            # by blocks, so the clipped float samples are never all in memory
+            for i in range(0, len(data), clip_block_size):
+                clipped = np.clip(data[i : i + clip_block_size], -1, 1)
+                np.multiply(
+                    clipped,
+                    int16_full_scale,
+                    out=out[i : i + clip_block_size],
+                    casting="unsafe",
+                )
+        else:
+            np.clip(data, -1, 1, out=out)
+
+    def chunks(
+        self, samp_freq, chunk_size=2**20, start=None, stop=None, dtype=np.float64
+    ):
+        # yields (offset, waveforms, marker) for consecutive chunks of chunk_size samples
+        # offset: of the chunk in samples, waveforms: of shape (n_channels, samples in the chunk)
+        # start, stop: in second, the range of waveforms() by default
+        # only the pulses overlapping a chunk are rendered, and only for the samples within it
+        # the yielded arrays are overwritten by the next chunk
+        dtype = self._output_dtype(dtype)
+        if chunk_size <= 0 or chunk_size % 16:
+            raise Exception("chunk_size should be a positive multiple of 16.")
+        entries, markers, left, right = self._plan_windows(samp_freq)
+        first = left if start is None else int(np.floor(start * samp_freq))
+        last = right if stop is None else int(np.ceil(stop * samp_freq))
+        windows = [
+            (offset, min(offset + chunk_size, last))
+            for offset in range(first, last, chunk_size)
+        ]
+        rendered = self._render_windows(
+            entries, markers, windows, dtype, "render chunk", chunk_size
+        )
+        for (offset, _), (waveforms, marker) in zip(windows, rendered):
+            yield offset, waveforms, marker
+
+    def segments(self, samp_freq, min_gap=5000, dtype=np.float64):
+        # the active times, found from where the pulses and the marker are, rendered alone
+        # returns a list of (start, end, waveforms, marker), start and end in samples from left,
+        # as find_active_time(threshold=min_gap) on 16 samples blocks, but no sample is tested
+        # a gap of no more than min_gap samples between two active times is merged
+        dtype = self._output_dtype(dtype)
+        entries, markers, left, right = self._plan_windows(samp_freq)
+        # the blocks of 16 samples of all the windows, merged over short gaps
+        blocks = sorted(
+            ((l - left) // 16, -((left - r) // 16))
+            for l, r in [(l, r) for l, r, _, _ in entries]
+            + [(l, r) for _, l, r in markers]
+            if l < r
+        )
+        active = list()
+        for start, end in blocks:
+            if active and (start - active[-1][1]) * 16 <= min_gap:
+                active[-1][1] = max(active[-1][1], end)
+            else:
+                active.append([start, end])
+        n_blocks = (right - left) // 16
+        if active and (n_blocks - active[-1][1]) * 16 <= min_gap:
+            active[-1][1] = n_blocks
+        windows = [(left + 16 * start, left + 16 * end) for start, end in active]
+        rendered = self._render_windows(
+            entries, markers, windows, dtype, "render segments"
+        )
+        # the range is the one of waveforms()
+        if (left, right) != (self.left, self.right):
+            self.left, self.right = left, right
+            self._changed = True
+        return [
+            (start - left, end - left, waveforms, marker)
+            for (start, end), (waveforms, marker) in zip(windows, rendered)
+        ]
+
+    def _plan_windows(self, samp_freq):
+        # the plans of the pulses and the marker windows, without rendering any
+        # returns (entries, markers, left, right), entries: (left, right, channel, plan)
+        # of the pulses in the order they are registered, all in samples
+        self.samp_freq = samp_freq
+        with self.profiler.stage("evaluate"):
+            self._push(self._sweepable_mapping)
+            entries = list()
+            for ch, channel in enumerate(self._pulses):
+                for entry in channel:
+                    plan, l, r = self._plan_entry(*entry, self._sweepable_mapping)
+                    if l < r:
+                        entries.append((l, r, ch, plan))
+        left, right = self._span([(l, r) for l, r, _, _ in entries])
+        return entries, self._marker_windows(left, right), left, right
+
+    def _marker_specs(self, mapping=None):
+        # (mask, positions, width) of all the markers, evaluated with mapping if given
+        # mask: the packed bits of the marker, see markers()
+        specs = [(self._marker_mask(0, None), self._trigger_pos, self._marker_width)]
+        specs += [
+            (self._marker_mask(bit, core), p, w)
+            for (bit, core), (p, w) in sorted(
+                self._markers.items(), key=lambda item: (item[0][0], item[0][1] or 0)
+            )
+        ]
+        if mapping is None:
+            evaluate = self.retrieve_value
+        else:
+            evaluate = lambda expr: self._evaluate(expr, mapping)
+        return [
+            (
+                mask,
+                np.array([evaluate(v) for v in positions], dtype=float),
+                evaluate(width),
+            )
+            for mask, positions, width in specs
+        ]
+
+    @staticmethod
+    def _marker_mask(bit, core):
+        # the packed bits of a marker bit of a core, or of all the cores if None
+        cores = range(n_marker_cores) if core is None else [core]
+        return sum(1 << (marker_bits_per_core * c + bit) for c in cores)
+
+    def _marker_windows(self, left, right):
+        # (mask, start, end) (in samples) where the marker bits are high, within [left, right)
+        windows = list()
+        for mask, positions, width in self._marker_specs():
+            for trig in positions:
+                trig_left = trig * self.samp_freq - left
+                windows.append(
+                    (
+                        mask,
+                        left + int(trig_left),
+                        min(left + int(trig_left + width * self.samp_freq), right),
+                    )
+                )
+        return windows
+
+    @staticmethod
+    def _pack_markers(windows, start, end):
+        # the marker bits of the samples [start, end) as uint16, windows: see _marker_windows
+        marker = np.zeros(end - start, dtype=np.uint16)
+        for mask in sorted({m for m, _, _ in windows}):
+            bounds = np.array([(l, r) for m, l, r in windows if m == mask]) - start
+            bounds = np.clip(bounds, 0, end - start)
+            bounds = bounds[bounds[:, 0] < bounds[:, 1]]
+            if not len(bounds):
+                continue
+            # +1 where a window starts and -1 where it ends, high where the sum is positive
+            edges = np.zeros(end - start + 1, dtype=np.int32)
+            np.add.at(edges, bounds[:, 0], 1)
+            np.add.at(edges, bounds[:, 1], -1)
+            high = np.cumsum(edges[:-1]) > 0
+            marker[high] |= np.uint16(mask)
+        return marker
+
+    def _render_windows(self, entries, markers, windows, dtype, stage, size=None):
+        # markers: see _marker_windows
+        # yields (waveforms, marker) of each window [start, end), sorted and not overlapping
+        # the buffers are allocated for each window, or reused if size is given
+        by_left = sorted(range(len(entries)), key=lambda i: entries[i][0])
+        n_started, overlapping = 0, list()
+        accumulator = np.float64 if dtype == np.float64 else np.float32
+        n_channels = len(self._pulses)
+        for start, end in windows:
+            n = end - start
+            if size is None or start == windows[0][0]:
+                buffer_size = n if size is None else size
+                data = np.zeros((n_channels, buffer_size), dtype=accumulator)
+                out = np.empty((n_channels, buffer_size), dtype=dtype)
+            with self.profiler.stage(stage) as counts:
+                while n_started < len(by_left) and entries[by_left[n_started]][0] < end:
+                    overlapping.append(by_left[n_started])
+                    n_started += 1
+                overlapping = [i for i in overlapping if entries[i][1] > start]
+                data[:, :n] = 0
+                # accumulated in the same order as waveforms()
+                for i in sorted(overlapping):
+                    l, r, ch, plan = entries[i]
+                    l, r = max(l, start), min(r, end)
+                    data[ch, l - start : r - start] += plan.render(l, r)
+                    counts["samples"] += r - l
+                for ch in range(n_channels):
+                    self._clip_into(data[ch, :n], out[ch, :n])
+                marker = self._pack_markers(markers, start, end)
+                counts["bytes"] += out[:, :n].nbytes + marker.nbytes
+            yield out[:, :n], marker
+
+    def _range(self):
+        # range of the rendered pulses (in samples), including the trigger
+        return self._span(
+            [(l, l + len(wf)) for r in self._rendered for l, wf in r if len(wf)]
+        )
+
+    def _span(self, windows):
+        # range covering the windows [left, right) (in samples) and the markers
+        left = min([l for l, _ in windows], default=np.inf)
+        right = max([r for _, r in windows], default=-np.inf)
+        for _, positions, width in self._marker_specs():
+            left, right = self._include_trigger(left, right, positions, width)
+        # padded to make the waveform to align with 16 samples (artifacts of zhinst)
+        right += (left - right) % 16
+        return left, right
+
+    def _push(self, mapping, entries=None):
+        # bind the values of the sweepables to the registered pulses and carriers
+        if entries is None:
+            entries = [entry for channel in self._pulses for entry in channel]
+        nodes = dict()
+        for _, pulse, carrier in entries:
+            nodes[id(pulse)], nodes[id(carrier)] = pulse, carrier
+        for node in nodes.values():
+            for k, v in mapping.items():
+                node.subs(k, v)
+
+    def _include_trigger(self, left, right, trigger_pos, marker_width):
+        # the range should include trigger position
+        trig_pos = np.round(trigger_pos * self.samp_freq)  # in samples
+        trig_left = np.min(trig_pos) - 1  # in samples
+        trig_right = np.max(trig_pos) + marker_width * self.samp_freq  # in samples
+        return int(min(left, trig_left)), int(max(right, trig_right))
+
+    def render_sweep(self, sweeps, samp_freq):
+        # sweeps: {sweepable: values}, the i-th values of all sweepables form the i-th point
+        # returns an array of shape (n_points, n_channels, n_samples) on a common range
+        with self.profiler.stage("render sweep") as counts:
+            result = self._render_sweep(sweeps, samp_freq)
+            counts["samples"] += result.size
+            counts["bytes"] += result.nbytes
+        return result
+
+    def _render_sweep(self, sweeps, samp_freq):
+        self.samp_freq = samp_freq
+        names = [sym.name if isinstance(sym, Expr) else sym for sym in sweeps]
+        values = [np.atleast_1d(np.asarray(v, dtype=float)) for v in sweeps.values()]
+        n_points = len(values[0]) if values else 1
+        if any(len(v) != n_points for v in values):
+            raise Exception("all sweepables should be given the same number of values")
+        swept = set(names)
+        points = [
+            {**self._sweepable_mapping, **dict(zip(names, p))}
+            for p in (zip(*values) if values else [()])
+        ]
+        self._push(self._sweepable_mapping)
+        # rendered pieces, shared: (channel, left, waveform), batched: (channel, left, coefs, basis)
+        # and per point: (point, channel, left, waveform)
+        shared, batched, single = list(), list(), list()
+        for ch, channel in enumerate(self._pulses):
+            for position, pulse, carrier in channel:
+                shape_names = expr_names(
+                    [
+                        pulse._left,
+                        pulse._right,
+                        pulse._displacement,
+                        pulse._extra_params,
+                    ]
+                )
+                for child in pulse.children:
+                    shape_names |= child.sweepable_names()
+                if not swept & (
+                    expr_names(position) | shape_names | expr_names(carrier.frequency)
+                ):
+                    # the swept values only enter gain, offset or phase: render once
+                    self._render_batched(
+                        ch, position, pulse, carrier, points, swept, shared, batched
+                    )
+                else:
+                    for p, mapping in enumerate(points):
+                        self._push(mapping, [(position, pulse, carrier)])
+                        left, wf = self._render_entry(position, pulse, carrier, mapping)
+                        single.append((p, ch, left, wf))
+        # a common range for all points
+        pieces = [(l, len(wf)) for _, l, wf in shared]
+        pieces += [(l, basis.shape[1]) for _, l, _, basis in batched]
+        pieces += [(l, len(wf)) for _, _, l, wf in single]
+        left = min([l for l, _ in pieces], default=np.inf)
+        right = max([l + n for l, n in pieces], default=-np.inf)
+        for mapping in points:
+            for _, positions, width in self._marker_specs(mapping):
+                left, right = self._include_trigger(left, right, positions, width)
+        # padded to make the waveform to align with 16 samples (artifacts of zhinst)
+        right += (left - right) % 16
+        result = np.zeros((n_points, len(self._pulses), right - left))
+        for ch, l, wf in shared:
+            result[:, ch, l - left : l - left + len(wf)] += wf
+        for ch, l, coefs, basis in batched:
+            result[:, ch, l - left : l - left + basis.shape[1]] += coefs @ basis
+        for p, ch, l, wf in single:
+            result[p, ch, l - left : l - left + len(wf)] += wf
+        # restore the values of the swept sweepables
+        self._push({name: self._sweepable_mapping.get(name, 0) for name in swept})
+        self.left, self.right = left, right
+        self._changed = True  # the cached waveforms no longer match left and right
+        return np.clip(result, -1, 1, out=result)
+
+    def _render_entry(self, position, pulse, carrier, mapping):
+        return self._render_plan(*self._plan_entry(position, pulse, carrier, mapping))
+
+    def _plan_entry(self, position, pulse, carrier, mapping):
+        # the values of the sweepables should already be bound to pulse and carrier
+        plan = Plan(self.samp_freq)
+        left, right = plan.add(pulse, self._evaluate(position, mapping), carrier)
+        return plan, left, right
+
+    @staticmethod
+    def _render_plan(plan, left, right):
+        if left >= right:
+            return left, np.array([])
+        return left, plan.render(left, right)
+
+    def _render_batched(
+        self, ch, position, pulse, carrier, points, swept, shared, batched
+    ):
+        # the envelope with unit gain and no offset, the same for all points
+        envelope = pulse._derive()
+        envelope._gain, envelope._offset = 1, 0
+        plan = Plan(self.samp_freq)
+        left, right = plan.add(envelope, self.retrieve_value(position))
+        if left > right:
+            return
+        if not swept & (
+            expr_names(pulse._gain)
+            | expr_names(pulse._offset)
+            | expr_names(carrier.phase)
+        ):
+            left, wf = self._render_entry(
+                position, pulse, carrier, self._sweepable_mapping
+            )
+            shared.append((ch, left, wf))
+            return
+        x = np.arange(left, right)
+        env = plan.render(left, right)
+        gains = [
+            self._evaluate(pulse._gain, {**pulse._sweepable_mapping, **m})
+            for m in points
+        ]
+        offsets = [
+            self._evaluate(pulse._offset, {**pulse._sweepable_mapping, **m})
+            for m in points
+        ]
+        if swept & expr_names(carrier.phase):
+            # cos(wt + phase) = cos(phase) * cos(wt) - sin(phase) * sin(wt)
+            frequency = carrier.extra_params[0]
+            phases = [
+                self._evaluate(carrier.phase, {**carrier._sweepable_mapping, **m})
+                for m in points
+            ]
+            phases = np.array(phases) * np.pi / 180
+            omega_t = 2 * np.pi * frequency * x / self.samp_freq
+            quadratures = [
+                (np.cos(phases), np.cos(omega_t)),
+                (-np.sin(phases), np.sin(omega_t)),
+            ]
+        else:
+            carrier_wave = carrier._shape(x, carrier.extra_params, self.samp_freq)
+            quadratures = [(np.ones(len(points)), carrier_wave)]
+        coefs, basis = list(), list()
+        for weight, quadrature in quadratures:
+            coefs.append(weight * np.array(gains))
+            basis.append(quadrature * env)
+            if np.any(offsets):
+                coefs.append(weight * np.array(offsets))
+                basis.append(quadrature)
+        batched.append((ch, left, np.stack(coefs, axis=1), np.stack(basis)))
+
+    @staticmethod
+    def _evaluate(expr, mapping):
+        evaluator = SweepableExpr()
+        for k, v in mapping.items():
+            evaluator.subs(k, v)
+        return evaluator.retrieve_value(expr)
 
     def plot(self):
+        import matplotlib.pyplot as plt
+
         fig, ax = plt.subplots()
         waveforms = self.waveforms(self.samp_freq)
         x_axis = np.arange(self.left, self.right) / self.samp_freq
@@ -116,17 +709,76 @@ class Sequence(SweepableExpr):
         return fig
 
     def marker_waveform(self):
-        base = np.zeros(self.length())
-        for trig in self.trigger_pos:
-            trig_left = trig * self.samp_freq - self.left
-            base[
-                int(trig_left) : int(trig_left + self.marker_width * self.samp_freq)
-            ] = 1
-        return base
+        # bit 0 of markers(), the trigger, as 0 or 1
+        return (self.markers() & 1).astype(float)
+
+    def markers(self):
+        # the marker bits (see set_marker) of the samples of waveforms(), as uint16,
+        # bits 4 * core to 4 * core + 3 are the ones of the awg core, see core_marker
+        # cached until the markers or the range change
+        self._update(self.samp_freq)
+        windows = self._marker_windows(self.left, self.right)
+        key = (self.left, self.right, tuple(windows))
+        if self._marker_cache is None or self._marker_cache[0] != key:
+            marker = self._pack_markers(windows, self.left, self.right)
+            # shared by all the callers
+            marker.flags.writeable = False
+            self._marker_cache = (key, marker)
+        return self._marker_cache[1]
+
+    def export_rendered(
+        self,
+        path,
+        samp_freq,
+        sweep_values=None,
+        period=None,
+        repetitions=-1,
+        tolerance=0,
+        dtype=np.float64,
+    ):
+        # render and segment for the HDAWG, saved to the directory path, see load_rendered
+        # sweep_values: {name: value} used for this rendering only
+        # period: in second, the length of the sequence by default
+        # dtype: of the saved waveforms, see waveforms()
+        from .utils.zhinst_helpers import prepare_zhinst_hdawg
+
+        sweep_values = {
+            name.name if isinstance(name, Expr) else name: value
+            for name, value in (sweep_values or dict()).items()
+        }
+        previous = {name: self._sweepable_mapping.get(name, 0) for name in sweep_values}
+        try:
+            for name, value in sweep_values.items():
+                self.subs(name, value)
+            if period is None:
+                self.samp_freq = samp_freq
+                period = self.length() / samp_freq
+            prepared = prepare_zhinst_hdawg(
+                self, period, repetitions, samp_freq, tolerance=tolerance, dtype=dtype
+            )
+            save_rendered(
+                path,
+                prepared,
+                samp_freq=samp_freq,
+                left=int(self.left),
+                right=int(self.right),
+                n_channels=len(self._pulses),
+                period=period,
+                repetitions=repetitions,
+                sweep_values=sweep_values,
+            )
+        finally:
+            for name, value in previous.items():
+                self.subs(name, value)
 
     def dump(self, file):
         dumped = dict()
         dumped["trigger pos"] = str(self._trigger_pos)
+        if self._markers:
+            dumped["markers"] = [
+                {"bit": bit, "core": core, "positions": str(p), "width": str(w)}
+                for (bit, core), (p, w) in self._markers.items()
+            ]
         for i, channel in enumerate(self._pulses):
             dumped[i] = dict()
             for j, (position, pulse, carrier) in enumerate(channel):
@@ -138,23 +790,89 @@ class Sequence(SweepableExpr):
             f.writelines(json.dumps(dumped, indent=4))
 
     def load(self, file):
-        with open(file, "r") as f:
-            sym_list = set()
-            dumped = json.load(f)
-            n_channels = len(dumped) - 1
-            self.__init__(n_channels)
-            self._trigger_pos = str2expr(dumped["trigger pos"])
-            sym_list |= collect_sym(dumped["trigger pos"])
-            for i in range(n_channels):
-                for k, v in dumped[str(i)].items():
-                    position = str2expr(v["position"])
-                    sym_list |= collect_sym(v["position"])
-                    pulse, syms = reconstruct(v["pulse"])
-                    sym_list |= syms
-                    carrier, syms = reconstruct(v["carrier"])
-                    sym_list |= syms
-                    self.register(position, pulse, carrier, channel=i)
-            return [Sweepable(sym) for sym in sym_list]
+        with open(file, "rb") as f:
+            content = f.read()
+        key = hashlib.blake2b(content).digest()
+        if key in load_cache:
+            load_cache.move_to_end(key)
+            parsed = load_cache[key]
+        else:
+            parsed = self._parse(content)
+            load_cache[key] = parsed
+            while len(load_cache) > load_cache_size:
+                load_cache.popitem(last=False)
+        if key == self._loaded:
+            self._reload(parsed)
+        else:
+            self.__init__(len(parsed["channels"]))
+            self._trigger_pos = copy.deepcopy(parsed["trigger pos"])
+            self._markers = copy.deepcopy(parsed["markers"])
+            for i, entries in enumerate(parsed["channels"]):
+                for position, pulse, carrier, dependencies in entries:
+                    # the cached pulses are shared, every sequence gets its own root
+                    self._pulses[i].append(
+                        (position, pulse._derive(), carrier._derive())
+                    )
+                    self._dependencies[i].append(dependencies)
+            self._changed = True
+            self._loaded = key
+        return [Sweepable(sym) for sym in parsed["sweepables"]]
+
+    def _reload(self, parsed):
+        # the file did not change: keep the pulses and their renderings,
+        # only reset what load() would reset, the sweepables are reset to the default 0
+        mapping = self._sweepable_mapping
+        self._sweepable_mapping = {name: 0 for name in mapping}
+        self._value_cache = dict()
+        self._dirty = {n for n in mapping if self._rendered_mapping.get(n, 0) != 0}
+        if self._trigger_pos != parsed["trigger pos"]:
+            self._trigger_pos = copy.deepcopy(parsed["trigger pos"])
+            self._changed = True
+        if self._markers != parsed["markers"]:
+            self._markers = copy.deepcopy(parsed["markers"])
+            self._changed = True
+        if self._marker_width != 100 / 2.4e9:
+            self.marker_width = 100 / 2.4e9
+        self.samp_freq = 2.4e9
+
+    @staticmethod
+    def _parse(content):
+        # every distinct string is parsed only once, see pulse_reconstruction.parse
+        dumped = json.loads(content)
+        sym_list = set()
+        n_channels = len([k for k in dumped if k.isdigit()])
+        trigger_pos = str2expr(dumped["trigger pos"])
+        sym_list |= collect_sym(dumped["trigger pos"])
+        markers = dict()
+        for marker in dumped.get("markers", list()):
+            markers[(marker["bit"], marker["core"])] = (
+                str2expr(marker["positions"]),
+                str2expr(marker["width"]),
+            )
+            sym_list |= collect_sym(marker["positions"]) | collect_sym(marker["width"])
+        channels = list()
+        for i in range(n_channels):
+            entries = list()
+            for k, v in dumped[str(i)].items():
+                position = str2expr(v["position"])
+                sym_list |= collect_sym(v["position"])
+                pulse, syms = reconstruct(v["pulse"])
+                sym_list |= syms
+                carrier, syms = reconstruct(v["carrier"])
+                sym_list |= syms
+                dependencies = frozenset(
+                    expr_names(position)
+                    | pulse.sweepable_names()
+                    | carrier.sweepable_names()
+                )
+                entries.append((position, pulse, carrier, dependencies))
+            channels.append(entries)
+        return {
+            "trigger pos": trigger_pos,
+            "markers": markers,
+            "channels": channels,
+            "sweepables": sorted(sym_list),
+        }
 
     @property
     def samp_freq(self):
@@ -171,3 +889,4 @@ class Sequence(SweepableExpr):
     @marker_width.setter
     def marker_width(self, value):
         self._marker_width = value
+        self._changed = True
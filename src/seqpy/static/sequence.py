@@ -1,6 +1,5 @@
 from .pulses import Pulse, Carrier
 import numpy as np
-import matplotlib.pyplot as plt
 
 
 class Sequence:
@@ -88,6 +87,8 @@ class Sequence:
         return np.minimum(np.maximum(waveform, min_cap), max_cap)
 
     def plot(self):
+        import matplotlib.pyplot as plt
+
         fig, ax = plt.subplots()
         waveforms = self.waveforms(self.sample_frequency)
         x_axis = self._get_time_axis()
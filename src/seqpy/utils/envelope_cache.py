@@ -0,0 +1,64 @@
+from collections import OrderedDict
+import threading
+
+
+class EnvelopeCache:
+    # least recently used cache of rendered envelopes, bounded by the memory they take
+    def __init__(self, max_bytes=64 * 2**20) -> None:
+        self._max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def max_bytes(self):
+        return self._max_bytes
+
+    @max_bytes.setter
+    def max_bytes(self, value):
+        # 0 disables the cache
+        with self._lock:
+            self._max_bytes = value
+            self._evict()
+
+    def get(self, key, render):
+        # return the envelope cached under key, render(): np.ndarray is called on a miss
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+        envelope = render()
+        if envelope.nbytes <= self._max_bytes:
+            # shared between all the users of the key, so it should never be modified
+            envelope.flags.writeable = False
+            with self._lock:
+                if key not in self._entries:
+                    self._entries[key] = envelope
+                    self.nbytes += envelope.nbytes
+                    self._evict()
+        return envelope
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def info(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self._entries),
+            "nbytes": self.nbytes,
+            "max_bytes": self._max_bytes,
+        }
+
+    def _evict(self):
+        while self.nbytes > self._max_bytes:
+            _, envelope = self._entries.popitem(last=False)
+            self.nbytes -= envelope.nbytes
@@ -2,7 +2,6 @@ from sympy import Piecewise
 from sympy.abc import x
 from seqpy.pulses import Carrier
 import numpy as np
-from scipy.interpolate import interp1d
 
 
 def interpolating_linear(sym, xdata, ydata):
@@ -26,10 +25,12 @@ class IQShifter:
         self.phase_curve = lambda x: 0
 
     def load_amplitude_calibration(self, freq, optimal_amp):
+        from scipy.interpolate import interp1d
         # self.amp_curve = interpolating_linear(x, freq, optimal_amp)
         self.amp_curve = interp1d(freq, optimal_amp)
 
     def load_phase_calibration(self, freq, optimal_phase):
+        from scipy.interpolate import interp1d
         # self.phase_curve = interpolating_linear(x, freq, optimal_phase)
         self.phase_curve = interp1d(freq, optimal_phase)
 
@@ -0,0 +1,67 @@
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict, deque
+
+
+def pipelined(prepare, points, depth=1):
+    # yields (point, prepare(point)) for all points, while the next depth points are
+    # prepared on a worker thread, e.g. rendering the next point during an upload
+    # an exception raised by prepare is raised again when its point is reached
+    points = iter(points)
+    pending = deque()
+    executor = ThreadPoolExecutor(max_workers=1)
+
+    def submit():
+        for point in points:
+            pending.append((point, executor.submit(prepare, point)))
+            return
+
+    try:
+        for i in range(depth + 1):
+            submit()
+        while pending:
+            point, future = pending.popleft()
+            result = future.result()
+            yield point, result
+            submit()
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+class Prefetcher:
+    # prepares guessed future points on a worker thread, at most depth of them
+    # points are identified by hashable keys, prepare(key) should only depend on the key
+    def __init__(self, prepare, depth=1) -> None:
+        self._prepare = prepare
+        self._depth = depth
+        self._futures = OrderedDict()
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self.hits = 0
+        self.misses = 0
+
+    def prefetch(self, key):
+        if key in self._futures:
+            return
+        while len(self._futures) >= self._depth:
+            # forget the oldest guess, it is not waited for
+            _, future = self._futures.popitem(last=False)
+            future.cancel()
+        self._futures[key] = self._executor.submit(self._prepare, key)
+
+    def get(self, key):
+        # the prepared result of the key, prepared here if it was not prefetched
+        # an exception raised by prepare is raised again here
+        future = self._futures.pop(key, None)
+        if future is None or future.cancelled():
+            self.misses += 1
+            return self._prepare(key)
+        self.hits += 1
+        return future.result()
+
+    def clear(self):
+        for future in self._futures.values():
+            future.cancel()
+        self._futures.clear()
+
+    def close(self):
+        self.clear()
+        self._executor.shutdown(wait=True)
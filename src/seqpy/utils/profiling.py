@@ -0,0 +1,68 @@
+from contextlib import contextmanager, nullcontext
+import time
+
+
+class Profiler:
+    # accumulated wall time, calls, samples and bytes produced of each stage
+    def __init__(self) -> None:
+        self.stages = dict()
+
+    @contextmanager
+    def stage(self, name):
+        # the yielded counts could be increased by the profiled code
+        counts = {"samples": 0, "bytes": 0}
+        start = time.perf_counter()
+        try:
+            yield counts
+        finally:
+            self.record(name, time.perf_counter() - start, **counts)
+
+    def record(self, name, elapsed, samples=0, bytes=0):
+        if name not in self.stages:
+            self.stages[name] = {"calls": 0, "time": 0.0, "samples": 0, "bytes": 0}
+        stats = self.stages[name]
+        stats["calls"] += 1
+        stats["time"] += elapsed
+        stats["samples"] += int(samples)
+        stats["bytes"] += int(bytes)
+
+    def reset(self):
+        self.stages = dict()
+
+    def info(self):
+        return {name: dict(stats) for name, stats in self.stages.items()}
+
+    def report(self):
+        lines = [
+            f"{'stage':<28}{'calls':>8}{'time (s)':>12}{'samples':>14}{'bytes':>14}"
+        ]
+        for name, stats in self.stages.items():
+            lines.append(
+                f"{name:<28}{stats['calls']:>8d}{stats['time']:>12.4f}"
+                f"{stats['samples']:>14d}{stats['bytes']:>14d}"
+            )
+        return "\n".join(lines)
+
+
+class NullProfiler:
+    # the default, records nothing
+    def __init__(self) -> None:
+        self.stages = dict()
+
+    def stage(self, name):
+        return nullcontext({"samples": 0, "bytes": 0})
+
+    def record(self, name, elapsed, samples=0, bytes=0):
+        pass
+
+    def reset(self):
+        pass
+
+    def info(self):
+        return dict()
+
+    def report(self):
+        return ""
+
+
+null_profiler = NullProfiler()
@@ -1,6 +1,8 @@
 # for resconstruction of pulses from dumped dictionary
 from ..pulses import *
 from sympy.parsing.sympy_parser import parse_expr
+from functools import lru_cache
+import copy
 import re
 
 
@@ -25,38 +27,55 @@ def typed(expr):
         return expr  # a 'real' sympy expression
 
 
+@lru_cache(maxsize=2**16)
+def parse(string):
+    # parse a dumped string only once, returns the typed expression and the names of its symbols
+    # (sympy expressions are immutable, so they can be shared)
+    expr = parse_expr(string)
+    syms = set()
+    for e in flatten([expr]):
+        for sym in e.atoms(Symbol):
+            syms.add(sym.name)
+    return typed(expr), frozenset(syms)
+
+
 def str2expr(string):
     if isinstance(string, list) or isinstance(string, tuple):
         return [str2expr(o) for o in string]
     else:
-        expr = parse_expr(string)
-        return typed(expr)
+        expr = parse(string)[0]
+        # lists (e.g. the trigger positions) are copied, the cached one should not be modified
+        return copy.deepcopy(expr) if isinstance(expr, list) else expr
 
 
 def collect_sym(expr):
     if isinstance(expr, list) or isinstance(expr, tuple):
-        return set.union(*[collect_sym(e) for e in expr])
+        return set().union(*[collect_sym(e) for e in expr])
     else:
-        syms = set()
-        parsed = flatten([parse_expr(expr)])
-        for e in parsed:
-            for sym in e.atoms(Symbol):
-                syms.add(sym.name)
-        return syms
+        return set(parse(expr)[1])
+
+
+# the pulses which could be reconstructed, by class name
+pulse_types = {k: v for k, v in list(globals().items())
+               if isinstance(v, type) and issubclass(v, Pulse)}
+
+
+@lru_cache(maxsize=None)
+def pulse_type(object_type):
+    pattern = r"<class '(?:\w*\.)*(\w*)'>"
+    return pulse_types[re.match(pattern, object_type).group(1)]
 
 
 def dict2atom(dumped: dict):
     if dumped["type"] != "atom":
         raise Exception("A leaf in not an atomic pulse!")
-    pattern = r"<class '(?:\w*\.)*(\w*)'>"
-    class_type = re.match(pattern, dumped["object type"]).group(1)
     # resolve the exprs and collect the variables
     syms = collect_sym([dumped["displacement"],
                         dumped["gain"],
                         dumped["offset"],
                         dumped["extra params"]])
     init_params = str2expr(dumped["extra params"])
-    base = eval(class_type)(*init_params)
+    base = pulse_type(dumped["object type"])(*init_params)
     displacement = str2expr(dumped["displacement"])
     gain = str2expr(dumped["gain"])
     offset = str2expr(dumped["offset"])
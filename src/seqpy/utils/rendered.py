@@ -0,0 +1,73 @@
+import numpy as np
+import json
+import os
+
+# a pre-rendered sequence is a directory of .npy files, which can be memory-mapped,
+# and a meta.json, so it can be loaded and uploaded without sympy or any rendering
+# this module only depends on numpy, see Sequence.export_rendered
+rendered_version = 1
+
+
+def save_rendered(path, prepared, **meta):
+    # prepared: see prepare_zhinst_hdawg, meta: anything json serializable
+    os.makedirs(path, exist_ok=True)
+    np.save(os.path.join(path, "channels.npy"), np.stack(prepared["waveforms"]))
+    np.save(os.path.join(path, "marker.npy"), np.asarray(prepared["marker"]))
+    np.save(
+        os.path.join(path, "active_times.npy"),
+        np.array(prepared["active_times"], dtype=np.int64).reshape(-1, 2),
+    )
+    np.save(
+        os.path.join(path, "core_indices.npy"),
+        np.array(prepared["core_indices"], dtype=np.int64).reshape(
+            len(prepared["core_indices"]), len(prepared["active_times"])
+        ),
+    )
+    with open(os.path.join(path, "program.seqc"), "w") as f:
+        f.write(prepared["program"])
+    meta = dict(meta)
+    meta["version"] = rendered_version
+    meta["core_fingerprints"] = [
+        [fingerprint.hex() for fingerprint in fingerprints]
+        for fingerprints in prepared["core_fingerprints"]
+    ]
+    # written last and replaced at once, a reader never sees a partial meta.json
+    temporary = os.path.join(path, "meta.json.tmp")
+    with open(temporary, "w") as f:
+        json.dump(meta, f, indent=4)
+    os.replace(temporary, os.path.join(path, "meta.json"))
+
+
+def load_rendered(path, mmap_mode="r"):
+    # returns the prepared dict of save_rendered, with the meta under "meta"
+    # the arrays are memory-mapped by default, pass mmap_mode=None to read them
+    with open(os.path.join(path, "meta.json"), "r") as f:
+        meta = json.load(f)
+    if meta.get("version") != rendered_version:
+        raise Exception(
+            f"unsupported version {meta.get('version')} of the rendered sequence {path}."
+        )
+    with open(os.path.join(path, "program.seqc"), "r") as f:
+        program = f.read()
+    channels = np.load(os.path.join(path, "channels.npy"), mmap_mode=mmap_mode)
+    marker = np.load(os.path.join(path, "marker.npy"), mmap_mode=mmap_mode)
+    active_times = [
+        (int(start), int(end))
+        for start, end in np.load(os.path.join(path, "active_times.npy"))
+    ]
+    return {
+        "waveforms": channels,
+        "marker": marker,
+        "n_channels": len(channels),
+        "segments": [
+            (channels[:, start:end], marker[start:end]) for start, end in active_times
+        ],
+        "active_times": active_times,
+        "core_indices": np.load(os.path.join(path, "core_indices.npy")).tolist(),
+        "core_fingerprints": [
+            [bytes.fromhex(fingerprint) for fingerprint in fingerprints]
+            for fingerprints in meta.pop("core_fingerprints")
+        ],
+        "program": program,
+        "meta": meta,
+    }
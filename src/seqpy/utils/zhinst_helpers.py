@@ -1,6 +1,6 @@
-from zhinst.toolkit import Sequence, Waveforms
+from .profiling import null_profiler
 import numpy as np
-import copy
+import hashlib
 import time
 import warnings
 
@@ -10,11 +10,14 @@ import warnings
 #
 # ----------------------------------------------------------
 
+# longest playZero written at once, longer waits are split into a loop
+max_play_zero = 2**20
+
 
 class SeqcFile:
     def __init__(self, n_channels) -> None:
-        self.file_string = ""
-        self._indentation = False
+        self._lines = list()
+        self._indentation = 0
         self._n_channels = n_channels
         self.make_header()
 
@@ -27,11 +30,26 @@ class SeqcFile:
         self._writeline(
             f"wave w_{i:d}_{j:d} = placeholder({length:d}, {marker_option});"
         )
-        # assign placeholder
-        # self._writeline(f"assignWaveIndex(w{index}_1, w{index}_2, 0);")
+
+    def assign_wave_index(self, index, *args):
+        # the index of the waves in the waveform memory, args: as play_wave
+        arguments = ", ".join([f"{channel+1}, w_{i}_{j}" for (channel, i, j) in args])
+        self._writeline(f"assignWaveIndex({arguments}, {index:d});")
 
     def wait(self, samples):
-        self._writeline(f"playZero({int(samples):d});")
+        samples = int(samples)
+        n_loops, rest = divmod(samples, max_play_zero)
+        if n_loops < 2 or (0 < rest < 32):
+            # playZero needs at least 32 samples, the rest is kept in a single one
+            if n_loops < 2:
+                self._writeline(f"playZero({samples:d});")
+                return
+            n_loops, rest = n_loops - 1, rest + max_play_zero
+        self.start_loop(n_loops)
+        self._writeline(f"playZero({max_play_zero:d});")
+        self.end_loop()
+        if rest:
+            self._writeline(f"playZero({rest:d});")
         # PlayZero should be better for shorter wait time, otherwise use wait, while wait(1) is actually 3 clock cycles
         # self._writeline(f"wait({int(samples/8):d});")
 
@@ -56,44 +74,121 @@ class SeqcFile:
         self._writeline(f"playWave({arguments});")
 
     def start_main_loop(self, iterations):
+        self.start_loop(iterations)
+
+    def end_main_loop(self):
+        self.end_loop()
+
+    def start_loop(self, iterations):
+        # loops can be nested, a negative number of iterations loops forever
         if iterations < 0:
             self._writeline(f"while(true){{")
         else:
             self._writeline(f"repeat({int(iterations):d}){{")
-        self._indentation = True
+        self._indentation += 1
 
-    def end_main_loop(self):
-        self._indentation = False
+    def end_loop(self):
+        self._indentation -= 1
         self._writeline("}")
 
     def comment_line(self, str):
         self._writeline(f"// {str}")
 
+    @property
+    def file_string(self):
+        return "".join(f"{line}\n" for line in self._lines)
+
     def _writeline(self, str):
-        if self._indentation:
-            self.file_string += f"\t{str}\n"
+        self._lines.append("\t" * self._indentation + str)
+
+
+def compress_runs(items, max_period=64):
+    # find the periodic runs in items, returns a list of (repetitions, body)
+    # where body is either an item (a leaf) or again a list of (repetitions, body)
+    compressed = list()
+    i = 0
+    while i < len(items):
+        best_saving, best_period, best_repetitions = 0, 1, 1
+        for period in range(1, min(max_period, (len(items) - i) // 2) + 1):
+            if items[i + period] != items[i]:
+                continue
+            body = items[i : i + period]
+            repetitions = 1
+            start = i + period
+            while items[start : start + period] == body:
+                repetitions += 1
+                start += period
+            # a loop costs two lines
+            saving = period * (repetitions - 1) - 2
+            if saving > best_saving:
+                best_saving, best_period, best_repetitions = (
+                    saving,
+                    period,
+                    repetitions,
+                )
+        if best_repetitions > 1:
+            body = items[i : i + best_period]
+            compressed.append((best_repetitions, compress_runs(body, max_period)))
+            i += best_period * best_repetitions
         else:
-            self.file_string += f"{str}\n"
+            compressed.append((1, items[i]))
+            i += 1
+    return compressed
 
 
-def seqc_generation(active_times, n_channels, total_length, repetitions, period):
+def seqc_generation(
+    active_times, n_channels, total_length, repetitions, period, wave_indices=None
+):
     # write the .seqC file
+    # wave_indices: for each channel, the wave played in each active time, see deduplicate_segments
     n_waveforms = len(active_times)
+    if wave_indices is None:
+        wave_indices = [range(n_waveforms)] * n_channels
     seqc_file = SeqcFile(n_channels)
-    # define all placeholders
+    # define all placeholders, once for each wave
+    defined = [set() for i in range(n_channels)]
     for j, (start, end) in enumerate(active_times):
         for i in range(n_channels):
-            seqc_file.define_placeholder(end - start, i, j)
+            if wave_indices[i][j] not in defined[i]:
+                seqc_file.define_placeholder(end - start, i, wave_indices[i][j])
+                defined[i].add(wave_indices[i][j])
+    # the waves of each distinct playWave get the next index, in the order they are played,
+    # as the waves are written to the waveform memory, see prepare_program
+    assigned = dict()
+    for j in range(n_waveforms):
+        waves = tuple(wave_indices[i][j] for i in range(n_channels))
+        if waves not in assigned:
+            assigned[waves] = len(assigned)
+            seqc_file.assign_wave_index(
+                assigned[waves], *[(i, i, w) for i, w in enumerate(waves)]
+            )
     seqc_file.start_main_loop(repetitions)
-    for i in range(len(active_times)):
-        args = [(j, j, i) for j in range(n_channels)]
-        seqc_file.play_wave(*args)
-        if i < n_waveforms - 1:
-            seqc_file.wait(active_times[i + 1][0] - active_times[i][1])
+    # (waves, wait after them) of every active time, periodic runs are written as loops
+    items = [
+        (
+            tuple(wave_indices[j][i] for j in range(n_channels)),
+            active_times[i + 1][0] - active_times[i][1] if i < n_waveforms - 1 else 0,
+        )
+        for i in range(n_waveforms)
+    ]
+
+    def write(compressed):
+        for repetitions, body in compressed:
+            if repetitions > 1:
+                seqc_file.start_loop(repetitions)
+                write(body)
+                seqc_file.end_loop()
+            else:
+                waves, wait = body
+                seqc_file.play_wave(*[(j, j, w) for j, w in enumerate(waves)])
+                if wait:
+                    seqc_file.wait(wait)
+
+    write(compress_runs(items))
     # offset to be confirmed
     if period > total_length:
         seqc_file.wait(period - total_length)
-    else:
+    elif period < total_length:
         warnings.warn(
             "given period is shorter than pulse length, ignore period instead."
         )
@@ -129,61 +224,120 @@ def readout_freerun_seqc_generation(total_length):
 #    zhinst wrapper
 #
 # ----------------------------------------------------------
-def find_active_time(waveforms, threshold=5000):
-    # find the period where at least one channel is not zero
-    nonzero = np.any(np.array(waveforms), axis=0)
-    nonzero_16 = np.any(nonzero.reshape(-1, 16), axis=1)
-    length_16 = len(nonzero_16)
-    active_times = list()
-    active_flag = False
-    p = 0  # current pointer position
-    ps = 0  # starting position of this active period
-    dead_l = 0  # length of the
-    while p < length_16:
-        if nonzero_16[p]:  # if current pointer is not zero
-            dead_l = 0
-            if not active_flag:
-                active_flag = (
-                    True  # if previously not a active period, now entering one
-                )
-                ps = p  # register the starting point
-        else:  # if current pointer is zero
-            if active_flag:
-                dead_l = dead_l + 1
-                if dead_l * 16 > threshold:
-                    active_flag = False  # if previously a zero period, now exiting
-                    # add this period if its length beyond the threshold
-                    active_times.append((ps * 16, (p + 1 - dead_l) * 16))
-                    dead_l = 0
-        p = p + 1
-    # handle last active period
-    if active_flag:
-        active_times.append((ps * 16, p * 16))
-    return active_times
-
-
-def update_zhinst_uhfqa(uhfqa, sequence, samp_freq=None, freerun=False):
+def find_active_time(waveforms, threshold=5000, tolerance=0):
+    # find the periods where at least one channel is not zero, in blocks of 16 samples
+    # periods separated by no more than threshold zero samples are merged
+    # samples with an amplitude not above tolerance are treated as zero
+    active = find_active_blocks(waveforms, tolerance)
+    if active is None:
+        return list()
+    return merge_active_blocks(active, threshold)
+
+
+def find_active_blocks(waveforms, tolerance=0):
+    # for each block of 16 samples, whether at least one channel is not zero there
+    active = None
+    for waveform in waveforms:
+        waveform = np.asarray(waveform)
+        nonzero = waveform != 0 if tolerance <= 0 else np.abs(waveform) > tolerance
+        nonzero_16 = np.any(nonzero.reshape(-1, 16), axis=1)
+        active = nonzero_16 if active is None else active | nonzero_16
+    return active
+
+
+def merge_active_blocks(active, threshold=5000):
+    # the periods (in samples) of the active blocks, see find_active_time
+    blocks = np.flatnonzero(active)
+    if not len(blocks):
+        return list()
+    # a period ends at a gap of more than threshold samples
+    gaps = (np.diff(blocks) - 1) * 16 > threshold
+    starts = np.concatenate([blocks[:1], blocks[1:][gaps]])
+    ends = np.concatenate([blocks[:-1][gaps] + 1, blocks[-1:] + 1])
+    # the last period extends to the end, unless followed by a long enough gap
+    if (len(active) - ends[-1]) * 16 <= threshold:
+        ends[-1] = len(active)
+    return [(int(start) * 16, int(end) * 16) for start, end in zip(starts, ends)]
+
+
+def deduplicate_segments(waveforms, active_times):
+    # for each active time: the index of the wave to play, identical segments share one
+    # waveforms: the channels played together, e.g. those of one awg core and the marker
+    # waves are numbered in the order they first appear
+    # returns the wave indices and the fingerprint (content hash) of each wave
+    return deduplicate_waves(
+        [[waveform[start:end] for waveform in waveforms] for start, end in active_times]
+    )
+
+
+def deduplicate_waves(waves):
+    # as deduplicate_segments, waves: for each active time the arrays played together
+    indices = dict()
+    wave_indices = list()
+    for arrays in waves:
+        wave_indices.append(indices.setdefault(fingerprint(arrays), len(indices)))
+    return wave_indices, list(indices)
+
+
+def core_marker(marker, core):
+    # the 4 marker bits of an awg core, packed by Sequence.markers
+    # a float marker, as saved before the bits were packed, is the same for all cores
+    marker = np.asarray(marker)
+    if not np.issubdtype(marker.dtype, np.integer):
+        return marker
+    return (marker >> (4 * core)) & 0xF
+
+
+def fingerprint(arrays):
+    # content hash of the arrays played together
+    digest = hashlib.blake2b()
+    for array in arrays:
+        digest.update(np.ascontiguousarray(array))
+    return digest.digest()
+
+
+# what was last programmed on each device (by serial): channel grouping and program source
+device_states = dict()
+
+
+def update_zhinst_uhfqa(
+    uhfqa,
+    sequence,
+    samp_freq=None,
+    freerun=False,
+    profiler=None,
+    force_compile=False,
+    dtype=np.float64,
+):
+    # profiler: records the timing of the stages, the one of the sequence by default
+    # force_compile: load the program even if it is the one already on the device
+    # dtype: of the rendered waveforms, int16 is uploaded without conversion
+    from zhinst.toolkit import Sequence, Waveforms
+
     if not samp_freq:
         samp_freq = 1.8e9
-    waveforms = copy.deepcopy(sequence.waveforms(samp_freq=samp_freq))
-    n_channels = len(waveforms)
+    if profiler is None:
+        profiler = sequence.profiler
+    with sequence.profile(profiler):
+        rendered = sequence.waveforms(samp_freq=samp_freq, dtype=dtype)
+    n_channels = len(rendered)
     if n_channels > 2:
         raise (
             Exception(
                 "the maximum channel number supported for Zurich Instruments UHFQA is 2."
             )
         )
-    elif n_channels == 1:
-        # padded to 2 channels
-        waveforms.append(np.zeros(sequence.length()))
-    waveforms = np.array(waveforms)
+    # copied, padded to 2 channels
+    waveforms = np.zeros((2, sequence.length()), dtype=dtype)
+    waveforms[:n_channels] = rendered
     digitization_start = sequence.trigger_pos * samp_freq - sequence.left
-    if not freerun:
-        seqc = readout_seqc_generation(
-            total_length=sequence.length(), digitization_start=digitization_start
-        )
-    else:
-        seqc = readout_freerun_seqc_generation(total_length=sequence.length())
+    with profiler.stage("seqc_generation"):
+        if not freerun:
+            seqc = readout_seqc_generation(
+                total_length=sequence.length(), digitization_start=digitization_start
+            )
+        else:
+            seqc = readout_freerun_seqc_generation(total_length=sequence.length())
     # compile the nominal awg
     # uhfqa.awg.set_sequence_params(sequence_type="Custom", path=seqc._filepath)
     # # upload the waveforms
@@ -194,10 +348,18 @@ def update_zhinst_uhfqa(uhfqa, sequence, samp_freq=None, freerun=False):
     awg_program.code = seqc.file_string
     uploaded_waveforms = Waveforms()
     uploaded_waveforms[0] = (waveforms[0], waveforms[1])
-    with uhfqa.set_transaction():
-        uhfqa.awgs[0].load_sequencer_program(awg_program)
-        uhfqa.awgs[0].write_to_waveform_memory(uploaded_waveforms)
-        uhfqa.awgs[0].enable(True)
+    state = device_states.setdefault(uhfqa.serial, dict())
+    with profiler.stage("write_to_waveform_memory") as counts:
+        with uhfqa.set_transaction():
+            # only the waveforms have to be written if the program is unchanged
+            if force_compile or state.get("program") != seqc.file_string:
+                state.pop("program", None)
+                uhfqa.awgs[0].load_sequencer_program(awg_program)
+            uhfqa.awgs[0].write_to_waveform_memory(uploaded_waveforms)
+            uhfqa.awgs[0].enable(True)
+        state["program"] = seqc.file_string
+        counts["samples"] += waveforms.size
+        counts["bytes"] += waveforms.nbytes
 
 
 # somehow the channel grouping is not working with offline compilation, so switch to awg module for n_channels >= 3
@@ -243,52 +405,353 @@ padding = [2, 1, 0, 1, 0, 3, 2, 1, 0]
 
 
 def update_zhinst_hdawg(
-    hdawg, session, sequence, period, repetitions=-1, samp_freq=None
+    hdawg,
+    session,
+    sequence,
+    period,
+    repetitions=-1,
+    samp_freq=None,
+    profiler=None,
+    tolerance=0,
+    force_compile=False,
+    dtype=np.float64,
+    chunk_size=None,
+    segments=False,
+):
+    # profiler: records the timing of the stages, the one of the sequence by default
+    # tolerance: amplitude below which samples are not uploaded, see find_active_time
+    # force_compile: compile the program even if it is the one already on the device
+    # dtype: of the rendered waveforms, int16 is uploaded without conversion
+    # chunk_size: render in chunks of so many samples, see prepare_zhinst_hdawg_streamed
+    # segments: render only where the pulses are, see prepare_zhinst_hdawg_segments
+    if profiler is None:
+        profiler = sequence.profiler
+    if segments:
+        prepared = prepare_zhinst_hdawg_segments(
+            sequence, period, repetitions, samp_freq, profiler, dtype
+        )
+    elif chunk_size is None:
+        prepared = prepare_zhinst_hdawg(
+            sequence, period, repetitions, samp_freq, profiler, tolerance, dtype
+        )
+    else:
+        prepared = prepare_zhinst_hdawg_streamed(
+            sequence,
+            period,
+            repetitions,
+            samp_freq,
+            profiler,
+            tolerance,
+            dtype,
+            chunk_size,
+        )
+    return upload_zhinst_hdawg(hdawg, session, prepared, profiler, force_compile)
+
+
+def prepare_zhinst_hdawg(
+    sequence,
+    period,
+    repetitions=-1,
+    samp_freq=None,
+    profiler=None,
+    tolerance=0,
+    dtype=np.float64,
 ):
+    # everything before talking to the device: render, segment and generate the program
+    # independent of the device, so it could run ahead in the background
     if not samp_freq:
         samp_freq = 2.4e9
-    waveforms = copy.deepcopy(sequence.waveforms(samp_freq=samp_freq))
-    # pad one channel if odd
-    n_channels = len(waveforms)
+    if profiler is None:
+        profiler = sequence.profiler
+    with sequence.profile(profiler):
+        rendered = sequence.waveforms(samp_freq=samp_freq, dtype=dtype)
+    n_channels = len(rendered)
     if n_channels > 8:
         raise (
             Exception(
                 "the maximum channel number supported for Zurich Instruments HDAWG is 8."
             )
         )
-    for i in range(padding[n_channels]):
-        waveforms.append(np.zeros(sequence.length()))
-        n_channels += 1
-    hdawg.awgs[0].enable(False)  # need to stop before change channel grouping
-    hdawg.system.awg.channelgrouping(
-        np.log2(n_channels - 1)
-    )  # update channel group in zhinst-toolkit 0->2*4, 1->4*2, 2->8*1
-    # find active time
-    active_times = find_active_time(waveforms + [sequence.marker_waveform()])
-    # generate and compile the .seqc file
-    seqc = seqc_generation(
-        active_times=active_times,
-        n_channels=n_channels,
-        total_length=sequence.length(),
-        repetitions=repetitions,
-        period=int(period * samp_freq),
+    # copied, so it is not changed by the next rendering, and padded to a supported grouping
+    waveforms = np.zeros(
+        (n_channels + padding[n_channels], sequence.length()), dtype=dtype
+    )
+    waveforms[:n_channels] = rendered
+    n_channels = len(waveforms)
+    # the marker bits, see Sequence.set_marker
+    marker = sequence.markers()
+    if np.issubdtype(waveforms.dtype, np.integer):
+        # int16 waveforms are scaled to the full range
+        tolerance = tolerance * np.iinfo(waveforms.dtype).max
+    # find active time, the tolerance is for the waveforms, any marker bit is active
+    with profiler.stage("find_active_time") as counts:
+        active_times = merge_active_blocks(
+            find_active_blocks(waveforms, tolerance) | find_active_blocks([marker])
+        )
+        counts["samples"] += (n_channels + 1) * sequence.length()
+    segments = [
+        (waveforms[:, start:end], marker[start:end]) for start, end in active_times
+    ]
+    prepared = prepare_program(
+        segments,
+        active_times,
+        n_channels,
+        sequence.length(),
+        int(round(period * samp_freq)),
+        repetitions,
+        profiler,
+    )
+    prepared["waveforms"], prepared["marker"] = waveforms, marker
+    return prepared
+
+
+def prepare_zhinst_hdawg_streamed(
+    sequence,
+    period,
+    repetitions=-1,
+    samp_freq=None,
+    profiler=None,
+    tolerance=0,
+    dtype=np.float64,
+    chunk_size=2**20,
+):
+    # as prepare_zhinst_hdawg, without the waveforms of the whole sequence for long ones:
+    # rendered twice in chunks, to find the active times and then to copy them out
+    # only the segments are kept, "waveforms" and "marker" are None
+    if not samp_freq:
+        samp_freq = 2.4e9
+    if profiler is None:
+        profiler = sequence.profiler
+    if np.issubdtype(np.dtype(dtype), np.integer):
+        tolerance = tolerance * np.iinfo(dtype).max
+    blocks = list()
+    with sequence.profile(profiler):
+        for offset, channels, marker in sequence.chunks(
+            samp_freq, chunk_size, dtype=dtype
+        ):
+            if not blocks:
+                left, n_rendered = offset, len(channels)
+            with profiler.stage("find_active_time") as counts:
+                blocks.append(
+                    find_active_blocks(channels, tolerance)
+                    | find_active_blocks([marker])
+                )
+                counts["samples"] += (len(channels) + 1) * len(marker)
+    if n_rendered > 8:
+        raise (
+            Exception(
+                "the maximum channel number supported for Zurich Instruments HDAWG is 8."
+            )
+        )
+    n_channels = n_rendered + padding[n_rendered]
+    total_length = 16 * sum(len(b) for b in blocks)
+    active_times = merge_active_blocks(np.concatenate(blocks))
+    segments = [
+        (
+            np.zeros((n_channels, end - start), dtype=dtype),
+            np.zeros(end - start, dtype=np.uint16),
+        )
+        for start, end in active_times
+    ]
+    # the segments before the first one overlapping the chunk are complete
+    first = 0
+    with sequence.profile(profiler):
+        for offset, channels, marker in sequence.chunks(
+            samp_freq, chunk_size, dtype=dtype
+        ):
+            with profiler.stage("copy segments") as counts:
+                offset -= left
+                end = offset + len(marker)
+                while first < len(active_times) and active_times[first][1] <= offset:
+                    first += 1
+                for (start, stop), (seg_channels, seg_marker) in zip(
+                    active_times[first:], segments[first:]
+                ):
+                    if start >= end:
+                        break
+                    l, r = max(start, offset), min(stop, end)
+                    seg_channels[:n_rendered, l - start : r - start] = channels[
+                        :, l - offset : r - offset
+                    ]
+                    seg_marker[l - start : r - start] = marker[l - offset : r - offset]
+                    counts["samples"] += (n_rendered + 1) * (r - l)
+    prepared = prepare_program(
+        segments,
+        active_times,
+        n_channels,
+        total_length,
+        int(round(period * samp_freq)),
+        repetitions,
+        profiler,
+    )
+    prepared["waveforms"], prepared["marker"] = None, None
+    return prepared
+
+
+def prepare_zhinst_hdawg_segments(
+    sequence,
+    period,
+    repetitions=-1,
+    samp_freq=None,
+    profiler=None,
+    dtype=np.float64,
+    min_gap=5000,
+):
+    # as prepare_zhinst_hdawg, but the active times are found from where the pulses and
+    # the marker are, see Sequence.segments, so only they are rendered
+    # the cost scales with the active time instead of the length of the sequence
+    # "waveforms" and "marker" are None
+    if not samp_freq:
+        samp_freq = 2.4e9
+    if profiler is None:
+        profiler = sequence.profiler
+    with sequence.profile(profiler):
+        rendered = sequence.segments(samp_freq, min_gap, dtype)
+    n_rendered = len(sequence._pulses)
+    if n_rendered > 8:
+        raise (
+            Exception(
+                "the maximum channel number supported for Zurich Instruments HDAWG is 8."
+            )
+        )
+    n_channels = n_rendered + padding[n_rendered]
+    active_times, segments = list(), list()
+    for start, end, channels, marker in rendered:
+        if n_channels > n_rendered:
+            channels = np.concatenate(
+                [channels, np.zeros((n_channels - n_rendered, end - start), dtype)]
+            )
+        active_times.append((start, end))
+        segments.append((channels, marker))
+    prepared = prepare_program(
+        segments,
+        active_times,
+        n_channels,
+        sequence.right - sequence.left,
+        int(round(period * samp_freq)),
+        repetitions,
+        profiler,
     )
+    prepared["waveforms"], prepared["marker"] = None, None
+    return prepared
+
+
+def prepare_program(
+    segments, active_times, n_channels, total_length, period, repetitions, profiler
+):
+    # segments: (channels, marker) of each active time, period: in samples
+    # identical segments are uploaded only once, the cores of a grouped sequencer play
+    # their waves in one playWave, so segments share an index only if they are identical
+    # on all the cores, and all the cores use the same indices
+    with profiler.stage("deduplicate_segments") as counts:
+        indices, _ = deduplicate_waves(
+            [list(channels) + [marker] for channels, marker in segments]
+        )
+        # the first segment of each index
+        firsts = dict()
+        for j, index in enumerate(indices):
+            firsts.setdefault(index, j)
+        core_indices, core_fingerprints = list(), list()
+        for i in range(n_channels // 2):
+            core_indices.append(list(indices))
+            core_fingerprints.append(
+                [
+                    fingerprint(
+                        [channels[2 * i], channels[2 * i + 1], core_marker(marker, i)]
+                    )
+                    for channels, marker in [segments[j] for j in firsts.values()]
+                ]
+            )
+        counts["samples"] += (n_channels + 1) * sum(
+            end - start for start, end in active_times
+        )
+    # generate the .seqc file
+    with profiler.stage("seqc_generation") as counts:
+        seqc = seqc_generation(
+            active_times=active_times,
+            n_channels=n_channels,
+            total_length=total_length,
+            repetitions=repetitions,
+            period=period,
+            wave_indices=[core_indices[i // 2] for i in range(n_channels)],
+        )
+        counts["bytes"] += len(seqc.file_string)
+    return {
+        "n_channels": n_channels,
+        "segments": segments,
+        "active_times": active_times,
+        "core_indices": core_indices,
+        "core_fingerprints": core_fingerprints,
+        "program": seqc.file_string,
+    }
+
+
+def upload_zhinst_hdawg(hdawg, session, prepared, profiler=None, force_compile=False):
+    # prepared: see prepare_zhinst_hdawg
+    # returns the number of bytes written to and skipped for the waveform memory
+    from zhinst.toolkit import Waveforms
+
+    if profiler is None:
+        profiler = null_profiler
+    segments = prepared["segments"]
+    active_times = prepared["active_times"]
+    core_indices = prepared["core_indices"]
+    core_fingerprints = prepared["core_fingerprints"]
+    n_channels = prepared["n_channels"]
+    hdawg.awgs[0].enable(False)  # need to stop before change channel grouping
+    # update channel group in zhinst-toolkit 0->2*4, 1->4*2, 2->8*1
+    grouping = np.log2(n_channels - 1)
+    state = device_states.setdefault(hdawg.serial, dict())
+    if force_compile or state.get("grouping") != grouping:
+        # the program has to be compiled again for the new grouping
+        state.clear()
+        hdawg.system.awg.channelgrouping(grouping)
+        state["grouping"] = grouping
     # awg_program = Sequence()
     # awg_program.code = seqc.file_string
-    compile_seqc(session, hdawg, seqc.file_string)
+    # only the waveforms have to be written if the program is unchanged
+    if state.get("program") != prepared["program"]:
+        # a new program starts with an empty waveform memory
+        state.pop("program", None)
+        state.pop("fingerprints", None)
+        with profiler.stage("compile_seqc"):
+            compile_seqc(session, hdawg, prepared["program"])
+        state["program"] = prepared["program"]
 
     # queue the waveforms, setup everything
-    with hdawg.set_transaction():
-        for i in range(n_channels // 2):
-            uploaded_waveforms = Waveforms()
-            ind = 0
-            for start, end in active_times:
-                uploaded_waveforms.assign_waveform(
-                    ind,
-                    waveforms[2 * i][start:end],
-                    waveforms[2 * i + 1][start:end],
-                    sequence.marker_waveform()[start:end],
-                )
-                ind += 1
-            hdawg.awgs[i].write_to_waveform_memory(uploaded_waveforms)
-        # hdawg.awgs[0].enable(True)
+    # (core, wave index): fingerprint of what is in the waveform memory of the device
+    written = state.pop("fingerprints", dict())
+    stats = {"bytes_written": 0, "bytes_skipped": 0}
+    with profiler.stage("write_to_waveform_memory") as counts:
+        with hdawg.set_transaction():
+            for i in range(n_channels // 2):
+                uploaded_waveforms = Waveforms()
+                uploaded = set()
+                for (start, end), (channels, marker), ind in zip(
+                    active_times, segments, core_indices[i]
+                ):
+                    if ind in uploaded:
+                        continue
+                    uploaded.add(ind)
+                    n_bytes = 3 * (end - start) * channels.itemsize
+                    if written.get((i, ind)) == core_fingerprints[i][ind]:
+                        # only the segments which changed are written
+                        stats["bytes_skipped"] += n_bytes
+                        continue
+                    uploaded_waveforms.assign_waveform(
+                        ind,
+                        channels[2 * i],
+                        channels[2 * i + 1],
+                        core_marker(marker, i),
+                    )
+                    written[(i, ind)] = core_fingerprints[i][ind]
+                    stats["bytes_written"] += n_bytes
+                    counts["samples"] += 3 * (end - start)
+                    counts["bytes"] += n_bytes
+                indexes = list(uploaded_waveforms)
+                if indexes:
+                    hdawg.awgs[i].write_to_waveform_memory(uploaded_waveforms, indexes)
+            # hdawg.awgs[0].enable(True)
+    state["fingerprints"] = written
+    profiler.record("skipped_waveform_memory", 0, bytes=stats["bytes_skipped"])
+    return stats
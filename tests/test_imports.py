@@ -0,0 +1,22 @@
+import subprocess
+import sys
+
+# imported by seqpy only when they are used, the import time is tracked by the benchmarks
+heavy_modules = ["matplotlib", "scipy", "zhinst"]
+
+
+def imported_heavy_modules(statement):
+    # the heavy modules imported by statement in a fresh interpreter
+    code = (
+        "import sys\n"
+        f"{statement}\n"
+        f"print(*[m for m in {heavy_modules!r} if m in sys.modules])\n"
+    )
+    return subprocess.run(
+        [sys.executable, "-c", code], check=True, capture_output=True, text=True
+    ).stdout.split()
+
+
+def test_import_is_lazy():
+    statement = "import seqpy\nfor name in seqpy.__all__:\n    getattr(seqpy, name)"
+    assert imported_heavy_modules(statement) == []
@@ -0,0 +1,39 @@
+import numpy as np
+from seqpy import Gaussian, Rect, Sequence, sweepables
+from seqpy.pulses import Pulse
+
+x = sweepables("x")
+
+
+def test_subs_does_not_change_shared_pulses():
+    # derived pulses share their children, substituting one does not change the others
+    pulse = Gaussian(20e-9) * x + Rect(30e-9)
+    scaled = pulse * 0.5
+    scaled.subs(x, 1)
+    assert pulse.waveform.max() == 1
+    assert scaled.waveform.max() == 1
+    pulse.subs(x, 0.2)
+    assert scaled.waveform.max() == 1
+    shifted = pulse.shift(1e-8)
+    shifted.subs(x, 3)
+    assert pulse.waveform.max() == 1.2
+    assert shifted.waveform.max() == 4
+
+
+class Triangle(Pulse):
+    # defines its samples with _waveform(x), not _shape
+    def __init__(self, width):
+        self.width = width
+        super().__init__(-width / 2, width / 2)
+
+    def _waveform(self, x):
+        return np.maximum(1 - np.abs(x) / (self.width * self.samp_freq / 2), 0)
+
+
+def test_waveform_hook_is_rendered():
+    pulse = Triangle(20e-9) * 0.5
+    x = np.arange(pulse.left, pulse.right)
+    np.testing.assert_allclose(pulse.waveform, 0.5 * np.maximum(1 - np.abs(x) / 24, 0))
+    sequence = Sequence(1)
+    sequence.register(0, pulse, frequency=0, phase=0, channel=0)
+    assert np.max(sequence.waveforms(1.2e9)) == 0.5
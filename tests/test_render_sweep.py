@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+from seqpy import Sequence, Gaussian, Rect, sweepables
+
+amp, offset, phase = sweepables("amp offset phase")
+
+
+def sweep_sequence():
+    sequence = Sequence(2)
+    sequence.register(
+        0, Gaussian(20e-9) * amp + offset, frequency=100e6, phase=phase, channel=0
+    )
+    sequence.register(50e-9, Rect(30e-9), frequency=130e6, phase=0, channel=1)
+    return sequence
+
+
+@pytest.mark.parametrize("samp_freq", [2.4e9, 1.8e9])
+@pytest.mark.parametrize(
+    "name, values",
+    [(amp, [0.1, 0.5, 0.9]), (offset, [0, 0.2, 0.4]), (phase, [0, 45, 90])],
+)
+def test_render_sweep_matches_points(samp_freq, name, values):
+    # rendered at once, as the points rendered one by one
+    sequence = sweep_sequence()
+    sequence.subs(amp, 0.7)
+    batched = sequence.render_sweep({name: values}, samp_freq)
+    for point, value in zip(batched, values):
+        sequence.subs(name, value)
+        sequence._changed = True
+        expected = np.array(sequence.waveforms(samp_freq))
+        np.testing.assert_allclose(point, expected, rtol=0, atol=1e-12)
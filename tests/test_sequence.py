@@ -0,0 +1,55 @@
+import numpy as np
+from seqpy import Sequence, Gaussian, sweepables
+
+amp, delay = sweepables("amp delay")
+samp_freq = 2.4e9
+
+
+def test_waveforms_keep_their_values():
+    # one result per sweep point, the incremental rendering writes to new arrays
+    sequence = Sequence(1)
+    sequence.register(0, Gaussian(20e-9) * amp, frequency=100e6, phase=0, channel=0)
+    results = list()
+    for value in [0.1, 0.5, 0.9]:
+        sequence.subs(amp, value)
+        results.append(sequence.waveforms(samp_freq)[0])
+    np.testing.assert_allclose([r.max() for r in results], [0.1, 0.5, 0.9])
+
+
+def test_registered_pulses_are_not_shared():
+    # the values of a sequence are not bound to the pulse, nor to another sequence
+    pulse = Gaussian(20e-9) * amp
+    first, second = Sequence(1), Sequence(1)
+    first.register(delay, pulse, frequency=0, phase=0, channel=0)
+    second.register(0, pulse, frequency=0, phase=0, channel=0)
+    first.subs(amp, 0.2)
+    second.subs(amp, 0.9)
+    first.waveforms(samp_freq)
+    second.waveforms(samp_freq)
+    first.subs(delay, 1e-8)
+    assert np.max(first.waveforms(samp_freq)) == 0.2
+    assert np.max(second.waveforms(samp_freq)) == 0.9
+    assert pulse.gain == 0
+
+
+def test_subs_overrides_the_value_of_the_pulse():
+    # the pulse is registered with its own value, rendered before the sequence has one
+    pulse = Gaussian(20e-9) * amp
+    pulse.subs(amp, 0.3)
+    sequence = Sequence(1)
+    sequence.register(0, pulse, frequency=0, phase=0, channel=0)
+    assert np.max(sequence.waveforms(samp_freq)) == 0.3
+    sequence.subs(amp, 0)
+    assert np.max(sequence.waveforms(samp_freq)) == 0
+
+
+def test_markers_of_each_core():
+    # 4 marker bits for each core, the trigger is on all of them
+    sequence = Sequence(4)
+    sequence.register(0, Gaussian(20e-9), frequency=0, phase=0, channel=0)
+    sequence.trigger_pos = 0
+    sequence.set_marker(1, 1e-7, width=40e-9, core=1)
+    sequence.set_marker(3, 2e-7, width=40e-9)
+    markers = sequence.markers()
+    assert sorted(set(markers.tolist())) == [0, 0x20, 0x1111, 0x8888]
+    np.testing.assert_array_equal(sequence.marker_waveform(), markers & 1)
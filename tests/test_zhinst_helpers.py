@@ -0,0 +1,32 @@
+import numpy as np
+from seqpy.utils.profiling import null_profiler
+from seqpy.utils.zhinst_helpers import core_marker, prepare_program
+
+
+def test_cores_share_wave_indices():
+    # the segments repeat on the first core only, all the cores play one playWave
+    rng = np.random.default_rng(0)
+    repeated = rng.random(64)
+    segments = [
+        (np.stack([repeated, repeated, rng.random(64), rng.random(64)]), np.zeros(64))
+        for j in range(4)
+    ]
+    active_times = [(j * 10000, j * 10000 + 64) for j in range(4)]
+    prepared = prepare_program(
+        segments, active_times, 4, 40000, 50000, -1, null_profiler
+    )
+    assert prepared["core_indices"] == [[0, 1, 2, 3], [0, 1, 2, 3]]
+    assert [len(f) for f in prepared["core_fingerprints"]] == [4, 4]
+    assigned = [
+        line for line in prepared["program"].splitlines() if "assignWaveIndex" in line
+    ]
+    assert assigned[1] == "assignWaveIndex(1, w_0_1, 2, w_1_1, 3, w_2_1, 4, w_3_1, 1);"
+    assert len(assigned) == 4
+
+
+def test_core_marker():
+    marker = np.array([0x1111, 0x20, 0x8888], dtype=np.uint16)
+    assert core_marker(marker, 0).tolist() == [1, 0, 8]
+    assert core_marker(marker, 1).tolist() == [1, 2, 8]
+    # the float markers saved before are the same for all cores
+    assert core_marker(np.ones(3), 2).tolist() == [1, 1, 1]
@@ -1,6 +1,9 @@
 from BaseDriver import LabberDriver
 from zhinst.toolkit import Session
 from seqpy import *
+from seqpy.utils.pipeline import Prefetcher
+from seqpy.utils.rendered import load_rendered
+from seqpy.utils.zhinst_helpers import prepare_zhinst_hdawg_segments
 import numpy as np
 import os
 import hashlib
@@ -16,6 +19,29 @@ def hash_file(filename, blocksize=65536):
     return file_hash.hexdigest()
 
 
+def round_value(value):
+    # guessed values are extrapolated, so they should be compared with some tolerance
+    return float(f"{value:.12g}")
+
+
+def prepare_point(point):
+    # render and segment one point of a sweep, runs on the worker thread of the prefetcher
+    json_path, _, sweepables, samp_freq, period, repetitions, dtype, segments = point
+    sequence = Sequence()
+    sequence.load(json_path)
+    for key, value in sweepables:
+        if key != "":
+            sequence.subs(key, value)
+    sequence.samp_freq = samp_freq
+    if segments:
+        prepared = prepare_zhinst_hdawg_segments(
+            sequence, period, repetitions, samp_freq, dtype=dtype)
+    else:
+        prepared = prepare_zhinst_hdawg(
+            sequence, period, repetitions, samp_freq, dtype=dtype)
+    return sequence, prepared
+
+
 # change this value in case you are not using 'localhost'
 HOST = "localhost"
 
@@ -29,12 +55,19 @@ class Driver(LabberDriver):
         # change flag for awg updating
         self.change_flag = False
         self.old_hash = ""
+        # compile at least once, the device may run a program unknown to seqpy
+        self.force_compile = True
+        # timing of the update stages, collected when profiling is enabled
+        self.profiler = Profiler()
+        # renders the guessed next point of a sweep during the upload of the current one
+        self.prefetcher = Prefetcher(prepare_point)
+        self.last_point = None
         self.session = Session(HOST)
         self.controller = self.session.connect_device(self.comCfg.address[:7])
 
     def performClose(self, bError=False, options={}):
         """Perform the close instrument connection operation"""
-        pass
+        self.prefetcher.close()
 
     def initSetConfig(self):
         """This function is run before setting values in Set Config"""
@@ -65,8 +98,12 @@ class Driver(LabberDriver):
         if quant.name.startswith("SeqPy"):
             self.change_flag = True
 
+        if quant.name == "Profiling - Reset":
+            self.profiler.reset()
+
         # compilation button
         if quant.name.endswith("Update AWG"):
+            self.force_compile = True
             self.update_zhinst_hdawg()
 
         if self.isFinalCall(options):
@@ -81,6 +118,8 @@ class Driver(LabberDriver):
         if quant.get_cmd:
             node = self.controller.root.raw_path_to_node(quant.set_cmd)
             return node(enum=False)
+        elif quant.name == "Profiling - Report":
+            return self.profiler.report()
         elif quant.name.startswith("Waveforms"):
             self.update_sequence()
             n_channels = len(self.sequence.waveforms())
@@ -137,12 +176,16 @@ class Driver(LabberDriver):
 
     def update_zhinst_hdawg(self):
         json_path = self.get_json_path()
+        if os.path.isdir(json_path):
+            return self.update_zhinst_hdawg_rendered(json_path)
         if os.path.exists(json_path):
             current_hash = hash_file(json_path)
             if current_hash != self.old_hash:
                 self.change_flag = True
                 self.old_hash = current_hash
             if self.change_flag:
+                if self.getValue("Pipeline - Prefetch"):
+                    return self.update_zhinst_hdawg_pipelined(json_path)
                 # require for using trigger signal
                 # self.setValue("Marker Out - Signal 1", 4)
                 self.update_sequence()
@@ -154,15 +197,102 @@ class Driver(LabberDriver):
                             self.controller,
                             self.session,
                             self.sequence,
-                            self.getValue("SeqPy - Period") * samp_freq,
+                            self.getValue("SeqPy - Period"),
                             int(self.getValue("SeqPy - Repetitions")),
-                            samp_freq=samp_freq)
+                            samp_freq=samp_freq,
+                            profiler=self.get_profiler(),
+                            force_compile=self.force_compile,
+                            dtype=self.getValue("SeqPy - Sample Format"),
+                            segments=self.getValue("SeqPy - Render Segments"))
                         self.change_flag = False
+                        self.force_compile = False
                         return
                     except Exception as e:
                         caught_exception = e
                 raise caught_exception
 
+    def update_zhinst_hdawg_pipelined(self, json_path):
+        point = (
+            json_path,
+            self.old_hash,
+            tuple(
+                (self.getValue(f"SeqPy - Sweepable {i+1} Name"),
+                 round_value(self.getValue(f"SeqPy - Sweepable {i+1} Value")))
+                for i in range(3)),
+            self.getValue("Device - Sample Clock"),
+            self.getValue("SeqPy - Period"),
+            int(self.getValue("SeqPy - Repetitions")),
+            self.getValue("SeqPy - Sample Format"),
+            self.getValue("SeqPy - Render Segments"),
+        )
+        # errors of the rendering are raised here
+        self.sequence, prepared = self.prefetcher.get(point)
+        next_point = self.guess_next_point(point)
+        if next_point is not None:
+            self.prefetcher.prefetch(next_point)
+        # to avoid some random error seen in the measurement
+        for i in range(5):
+            try:
+                upload_zhinst_hdawg(
+                    self.controller,
+                    self.session,
+                    prepared,
+                    profiler=self.get_profiler(),
+                    force_compile=self.force_compile)
+                self.change_flag = False
+                self.force_compile = False
+                return
+            except Exception as e:
+                caught_exception = e
+        raise caught_exception
+
+    def update_zhinst_hdawg_rendered(self, path):
+        # a sequence exported by Sequence.export_rendered, uploaded as it is
+        # the period and repetitions are the ones it was exported with
+        current_hash = hash_file(os.path.join(path, "meta.json")) + hash_file(
+            os.path.join(path, "program.seqc"))
+        if current_hash != self.old_hash:
+            self.change_flag = True
+            self.old_hash = current_hash
+        if not self.change_flag:
+            return
+        prepared = load_rendered(path)
+        samp_freq = self.getValue("Device - Sample Clock")
+        if prepared["meta"]["samp_freq"] != samp_freq:
+            raise Exception(
+                f"{path} is rendered for a sample clock of {prepared['meta']['samp_freq']}, not {samp_freq}.")
+        # to avoid some random error seen in the measurement
+        for i in range(5):
+            try:
+                upload_zhinst_hdawg(
+                    self.controller,
+                    self.session,
+                    prepared,
+                    profiler=self.get_profiler(),
+                    force_compile=self.force_compile)
+                self.change_flag = False
+                self.force_compile = False
+                return
+            except Exception as e:
+                caught_exception = e
+        raise caught_exception
+
+    def guess_next_point(self, point):
+        # continue a linear sweep of the sweepable values, if only they changed
+        previous, self.last_point = self.last_point, point
+        if previous is None or previous[:2] + previous[3:] != point[:2] + point[3:]:
+            return None
+        sweepables = tuple(
+            (key, round_value(2 * value - previous_value))
+            for (key, value), (_, previous_value) in zip(point[2], previous[2]))
+        if sweepables == point[2]:
+            return None
+        return point[:2] + (sweepables,) + point[3:]
+
+    def get_profiler(self):
+        # None falls back to the (disabled) profiler of the sequence
+        return self.profiler if self.getValue("Profiling - Enable") else None
+
     def get_json_path(self):
         # for sweeeping json file name
         index = str(int(self.getValue("SeqPy - File Index")))
@@ -1,4 +1,5 @@
 from seqpy import *
+from seqpy.utils.pipeline import Prefetcher
 import numpy as np
 from zhinst.toolkit import Session
 from BaseDriver import LabberDriver
@@ -14,6 +15,23 @@ def hash_file(filename, blocksize=65536):
     return file_hash.hexdigest()
 
 
+def round_value(value):
+    # guessed values are extrapolated, so they should be compared with some tolerance
+    return float(f"{value:.12g}")
+
+
+def prepare_point(point):
+    # render one point of a sweep, runs on the worker thread of the prefetcher
+    json_path, _, sweepables, dtype = point
+    sequence = Sequence()
+    sequence.load(json_path)
+    for key, value in sweepables:
+        if key != "":
+            sequence.subs(key, value)
+    sequence.waveforms(samp_freq=1.8e9, dtype=dtype)
+    return sequence
+
+
 # change this value in case you are not using 'localhost'
 HOST = "localhost"
 
@@ -28,13 +46,20 @@ class Driver(LabberDriver):
         self.last_length = [0] * 2
         self.change_flag = False
         self.old_hash = ""
+        # compile at least once, the device may run a program unknown to seqpy
+        self.force_compile = True
         self.sequence = Sequence()
+        # timing of the update stages, collected when profiling is enabled
+        self.profiler = Profiler()
+        # renders the guessed next point of a sweep during the upload of the current one
+        self.prefetcher = Prefetcher(prepare_point)
+        self.last_point = None
         self.input_buffer = list()
         self.result_buffer = list()
 
     def performClose(self, bError=False, options={}):
         """Perform the close instrument connection operation"""
-        pass
+        self.prefetcher.close()
 
     def initSetConfig(self):
         """This function is run before setting values in Set Config"""
@@ -78,7 +103,11 @@ class Driver(LabberDriver):
         if quant.name.startswith("SeqPy"):
             self.change_flag = True
 
+        if quant.name == "Profiling - Reset":
+            self.profiler.reset()
+
         if quant.name.endswith("Update AWG"):
+            self.force_compile = True
             self.update_zhinst_uhfqa()
 
         if self.isFinalCall(options):
@@ -134,6 +163,8 @@ class Driver(LabberDriver):
             # if a 'get_cmd' is defined, use it to return the node value
             node = self.controller.root.raw_path_to_node(quant.set_cmd)
             value = node(enum=False)
+        elif quant.name == "Profiling - Report":
+            value = self.profiler.report()
         elif quant.name.startswith("Result Vector - QB"):
             if len(self.result_buffer) == 0:
                 self.result_buffer = self.get_qa_result(range(10))
@@ -282,6 +313,38 @@ class Driver(LabberDriver):
                 if key is not "":
                     self.sequence.subs(key, value)
 
+    def prefetch_sequence(self, json_path):
+        point = (
+            json_path,
+            self.old_hash,
+            tuple(
+                (self.getValue(f"SeqPy - Sweepable {i+1} Name"),
+                 round_value(self.getValue(f"SeqPy - Sweepable {i+1} Value")))
+                for i in range(3)),
+            self.getValue("SeqPy - Sample Format"),
+        )
+        # errors of the rendering are raised here
+        self.sequence = self.prefetcher.get(point)
+        next_point = self.guess_next_point(point)
+        if next_point is not None:
+            self.prefetcher.prefetch(next_point)
+
+    def guess_next_point(self, point):
+        # continue a linear sweep of the sweepable values, if only they changed
+        previous, self.last_point = self.last_point, point
+        if previous is None or previous[:2] + previous[3:] != point[:2] + point[3:]:
+            return None
+        sweepables = tuple(
+            (key, round_value(2 * value - previous_value))
+            for (key, value), (_, previous_value) in zip(point[2], previous[2]))
+        if sweepables == point[2]:
+            return None
+        return point[:2] + (sweepables,) + point[3:]
+
+    def get_profiler(self):
+        # None falls back to the (disabled) profiler of the sequence
+        return self.profiler if self.getValue("Profiling - Enable") else None
+
     def update_zhinst_uhfqa(self):
         json_path = self.getValue("SeqPy - Json Path")
         if os.path.exists(json_path):
@@ -290,14 +353,21 @@ class Driver(LabberDriver):
                 self.change_flag = True
                 self.old_hash = current_hash
             if self.change_flag:
-                self.update_sequence()
+                if self.getValue("Pipeline - Prefetch"):
+                    self.prefetch_sequence(json_path)
+                else:
+                    self.update_sequence()
                 for i in range(5):
                     try:
                         update_zhinst_uhfqa(
                             self.controller,
                             self.sequence,
-                            samp_freq=1.8e9)
+                            samp_freq=1.8e9,
+                            profiler=self.get_profiler(),
+                            force_compile=self.force_compile,
+                            dtype=self.getValue("SeqPy - Sample Format"))
                         self.change_flag = False
+                        self.force_compile = False
                         return
                     except Exception as e:
                         caught_exception = e